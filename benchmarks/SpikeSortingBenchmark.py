@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.analysis import SpikeFunctions
+
+
+def SyntheticRecording(nspikes, nchannels=2, framerate=10000, spacing=40, seed=0):
+    """
+    Function to make a recording with noise and spikes of random heights, for benchmarking.
+
+    Parameters
+    ----------
+    nspikes : int
+        Number of spikes per channel.
+    nchannels : int, optional
+        Number of channels. The default is 2.
+    framerate : int, optional
+        Sampling rate of the data. The default is 10000.
+    spacing : int, optional
+        Average number of samples between spikes. The default is 40.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    data : Array of float64
+        Array containing the data per channel.
+
+    """
+    rng=np.random.default_rng(seed)
+    nframes=nspikes*spacing
+    data=rng.normal(0, 20, (nchannels, nframes))
+    shape=np.array([0.3, 0.8, 1.0, 0.6, -0.4, -0.2])
+    for ii in range(nchannels):
+        starts=np.sort(rng.choice(np.arange(0, nframes-len(shape), len(shape)), nspikes, replace=False))
+        heights=rng.uniform(100, 1200, nspikes)
+        data[ii, starts[:, None]+np.arange(len(shape))]+=heights[:, None]*shape
+    return data
+
+def LinearDeduplication(peaklists, cutoffpeaks):
+    """Function with the membership tests that were used by SpikeSorting before sorted-index set operations, for comparison."""
+    kept=[]
+    for clusterN, peaks in enumerate(peaklists):
+        kept.append([x for x in peaks if x not in cutoffpeaks and not any(x in peaklists[jj] for jj in range(clusterN))])
+    return kept
+
+def SortedDeduplication(peaklists, cutoffpeaks):
+    """Function with the sorted-index set operations that SpikeSorting uses, for comparison."""
+    kept=[]
+    found=np.sort(np.asarray(cutoffpeaks, dtype=np.float64))
+    for peaks in peaklists:
+        kept.append(peaks[~SpikeFunctions._insorted(peaks, found)])
+        found=np.union1d(found, peaks)
+    return kept
+
+def timed(function, *args, **kwargs):
+    """Function to get the result and the run time in seconds of a function."""
+    start=time.perf_counter()
+    result=function(*args, **kwargs)
+    return result, time.perf_counter()-start
+
+def main():
+    parser=argparse.ArgumentParser(description="Benchmark of spike sorting on a synthetic recording.")
+    parser.add_argument("--spikes", type=int, default=100000, help="Number of spikes per channel.")
+    parser.add_argument("--channels", type=int, default=2, help="Number of channels.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[800, 600, 400, 200], help="Spike sorting thresholds.")
+    parser.add_argument("--cutoff", type=int, default=1100, help="Cut-off threshold.")
+    parser.add_argument("--linear", type=int, default=20000, help="Largest number of peaks of the lowest threshold for which the linear membership tests are timed, they take quadratic time.")
+    args=parser.parse_args()
+    thresholds=sorted(args.thresholds, key=abs)[::-1]
+    data=SyntheticRecording(args.spikes, args.channels)
+    print(f"Recording: {args.channels} channels, {data.shape[1]} samples, {args.spikes} spikes per channel")
+    #Peak lists of the first channel, as found by the legacy method
+    _, find_peaks=SpikeFunctions.PeakBackend()
+    (cutoffpeaks, _), _=find_peaks(data[0], args.cutoff)
+    peaklists=[find_peaks(data[0], th)[0][0] for th in thresholds]
+    print(f"Peaks per threshold on channel 1: {', '.join(str(len(peaks)) for peaks in peaklists)}, cut-off: {len(cutoffpeaks)}")
+    print("\nDe-duplication of the peaks of channel 1")
+    print(f"{'peaks':>10} {'linear (s)':>12} {'sorted (s)':>12}")
+    size=1000
+    while size<=max(len(peaks) for peaks in peaklists):
+        #Use the peaks in the first part of the recording, so all lists are cut at the same time
+        end=np.sort(peaklists[-1])[min(size, len(peaklists[-1]))-1]
+        lists=[peaks[peaks<=end] for peaks in peaklists]
+        cutoff=cutoffpeaks[cutoffpeaks<=end]
+        sortedresult, sortedtime=timed(SortedDeduplication, lists, cutoff)
+        if size<=args.linear:
+            linearresult, lineartime=timed(LinearDeduplication, [list(peaks) for peaks in lists], list(cutoff))
+            assert all(np.array_equal(a, b) for a, b in zip(linearresult, sortedresult))
+            print(f"{sum(len(peaks) for peaks in lists):>10} {lineartime:>12.4f} {sortedtime:>12.4f}")
+        else:
+            print(f"{sum(len(peaks) for peaks in lists):>10} {'-':>12} {sortedtime:>12.4f}")
+        size*=4
+    print("\nSpikeSorting on all channels")
+    print(f"{'method':>8} {'backend':>8} {'spikes':>10} {'time (s)':>10}")
+    for method in SpikeFunctions.SORTINGMETHODS:
+        for backend in SpikeFunctions.PEAKBACKENDS:
+            name, _=SpikeFunctions.PeakBackend(backend)
+            if name!=backend or (backend=="python" and args.spikes>20000):
+                continue
+            if backend=="numba":
+                #Compile before timing
+                SpikeFunctions.SpikeSorting(data[:, :1000], thresholds, 0.8, 10000, None, args.cutoff, backend, method)
+            clusters, duration=timed(SpikeFunctions.SpikeSorting, data, thresholds, 0.8, 10000, None, args.cutoff, backend, method)
+            nspikes=len(clusters)
+            print(f"{method:>8} {backend:>8} {nspikes:>10} {duration:>10.3f}")
+
+if __name__=="__main__":
+    main()
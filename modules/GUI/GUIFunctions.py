@@ -17,7 +17,6 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import scipy as sp
 import numpy as np
 import itertools
 import math
@@ -26,7 +25,75 @@ from PyQt5.QtWidgets import QCheckBox
 from collections import defaultdict
 from matplotlib.colors import TABLEAU_COLORS
 from modules.GUI.QtMplCanvas import QtCanvas
-from modules.analysis.SpikeFunctions import bandpassfilter, notchfilter, passfilter
+from modules.analysis.FilterFunctions import FilterChain, resample
+from modules.analysis.TimeAxis import TimeAxis
+from modules.analysis.SpectrumFunctions import Spectrum, LineNoise
+
+def PlotTrace(ax, time, data, channel, npoints=2000):
+    """
+    Function to plot the data of a channel.
+    Recordings from a multi-resolution .mrz file are plotted as the minimum and maximum values per pixel column, read from the stored levels.
+    The plot is read again for the visible time range when zooming or panning.
+
+    Parameters
+    ----------
+    ax : Axes
+        Axes to plot in.
+    time : TimeAxis
+        Time axis of the data.
+    data : Array or ChunkedRecording
+        Array containing y-values per channel.
+    channel : int
+        Index of the channel to plot.
+    npoints : int, optional
+        Maximum number of values to plot for a .mrz file. The default is 2000.
+
+    """
+    if not hasattr(data, "envelope"):
+        ax.plot(time, data[channel], color="k")
+        return
+    artists=[]
+    shown=[]
+    def draw(ax):
+        start, stop=(min(max(time.index(lim), 0), len(time)) for lim in ax.get_xlim())
+        if shown==[start, stop+1]:
+            return
+        shown[:]=[start, stop+1]
+        positions, minval, maxval=data.envelope(channel, start, stop+1, npoints)
+        [artist.remove() for artist in artists]
+        if minval is maxval:
+            artists[:]=ax.plot(time.seconds(positions), minval, color="k")
+        else:
+            artists[:]=[ax.fill_between(time.seconds(positions), minval, maxval, color="k", linewidth=0.5, step="mid")]
+        ax.figure.canvas.draw_idle()
+    ax.set_xlim(time.seconds(0), time.seconds(len(time)-1))
+    draw(ax)
+    ax.callbacks.connect("xlim_changed", draw)
+
+def Cached(self, key, function, *args, **kwargs):
+    """
+    Function to get a result from the result cache, the result is calculated and stored if it is not cached.
+
+    Parameters
+    ----------
+    key : tuple
+        Key of the result, containing the data version and all parameters of the calculation.
+    function : function
+        Function that calculates the result.
+    *args, **kwargs
+        Arguments of the function.
+
+    Returns
+    -------
+    result
+        The cached or calculated result.
+
+    """
+    result=self.cache.get(key)
+    if result is None:
+        result=function(*args, **kwargs)
+        self.cache.put(key, result)
+    return result
 
 def ViewRaw(self):
     """Function to plot the raw data in the Import recording tab."""
@@ -36,7 +103,7 @@ def ViewRaw(self):
     self.cnvs_rawrecording.axs=[]
     self.cnvs_rawrecording.axs=[self.cnvs_rawrecording.fig.add_subplot(size,1,1)]
     [self.cnvs_rawrecording.axs.append(self.cnvs_rawrecording.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_rawrecording.axs[0],sharey=self.cnvs_rawrecording.axs[0])) for ii in range(size-1)]
-    [self.cnvs_rawrecording.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(self.data)]
+    [PlotTrace(self.cnvs_rawrecording.axs[ii], self.time, self.data, ii) for ii in range(size)]
     self.cnvs_rawrecording.fig.text(0.01, 0.5, "Amplitude (A.U.)", va="center", rotation="vertical")
     self.cnvs_rawrecording.fig.text(0.5, 0.02, "Time (s)", ha="center")
     self.cnvs_rawrecording.draw()
@@ -49,25 +116,81 @@ def ViewUnfilter(self):
     self.cnvs_unfiltrecording.axs=[]
     self.cnvs_unfiltrecording.axs=[self.cnvs_unfiltrecording.fig.add_subplot(size,1,1)]
     [self.cnvs_unfiltrecording.axs.append(self.cnvs_unfiltrecording.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_unfiltrecording.axs[0],sharey=self.cnvs_unfiltrecording.axs[0])) for ii in range(size-1)]
-    [self.cnvs_unfiltrecording.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(self.data)]
+    [PlotTrace(self.cnvs_unfiltrecording.axs[ii], self.time, self.data, ii) for ii in range(size)]
     self.cnvs_unfiltrecording.fig.text(0.01, 0.5, "Amplitude (A.U.)", va="center", rotation="vertical")
     self.cnvs_unfiltrecording.fig.text(0.5, 0.02, "Time (s)", ha="center")
-    #Plot unfiltered data fft in filters tab
+    #Plot unfiltered power spectrum in filters tab
     [axis.remove() for axis in self.cnvs_unfiltfft.axs]
     self.cnvs_unfiltfft.axs=[]
     self.cnvs_unfiltfft.axs=[self.cnvs_unfiltfft.fig.add_subplot(size,1,1)]
     [self.cnvs_unfiltfft.axs.append(self.cnvs_unfiltfft.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_unfiltfft.axs[0],sharey=self.cnvs_unfiltfft.axs[0])) for ii in range(size-1)]
-    for ii,chdata in enumerate(self.data):
-        ndata=len(chdata)
-        yfft=sp.fft.fft(chdata)
-        xfft=sp.fft.fftfreq(ndata,1/self.framerate)[:ndata//2]
-        self.cnvs_unfiltfft.axs[ii].plot(xfft, 2.0/ndata*np.abs(yfft[0:ndata//2]), color="k")
-    self.cnvs_unfiltfft.fig.text(0.01, 0.5, "Power", va="center", rotation="vertical")
+    freqs, psd=Cached(self, ("spectrum", self.dataversion, self.framerate, self.spectrumsegment), Spectrum, self.data, self.framerate, self.spectrumsegment, workers=self.workers)
+    [self.cnvs_unfiltfft.axs[ii].semilogy(freqs, chpsd, color="k") for ii,chpsd in enumerate(psd)]
+    self.cnvs_unfiltfft.fig.text(0.01, 0.5, "Power spectral density (A.U.²/Hz)", va="center", rotation="vertical")
     self.cnvs_unfiltfft.fig.text(0.5, 0.02, "Frequency (Hz)", ha="center")
     self.cnvs_unfiltrecording.draw()
     self.cnvs_unfiltfft.draw()
 
-def ViewFilter(self, quality=30, order=2):
+def DetectLineNoise(self):
+    """
+    Function to estimate the power line frequency and harmonics from a sample of the data, see LineNoise, and set the notch filter to them in the Filter data tab.
+    The line frequency found in most channels is used, with the largest number of harmonics of those channels. If no line noise is found, the notch filter is unchecked and the harmonics are set to 0.
+    The result is shown in the tooltip of the notch filter.
+
+    Returns
+    -------
+    frequency : int
+        Detected line frequency, 0 if no line noise is found.
+    nharmonics : int
+        Detected number of harmonics.
+
+    """
+    frequency, nharmonics, _=LineNoise(self.data, self.framerate)
+    if not np.any(frequency):
+        self.ch_notch.setChecked(False)
+        self.sp_harmonics.setValue(0)
+        self.ch_notch.setToolTip("Filter out a single frequency.\nNo line noise detected in the loaded data, the notch filter is turned off.")
+        return 0, 0
+    values, counts=np.unique(frequency[frequency>0], return_counts=True)
+    line=int(values[np.argmax(counts)])
+    harmonics=int(np.max(nharmonics[frequency==line]))
+    self.ch_notch.setChecked(True)
+    self.sp_notch.setValue(line)
+    self.sp_harmonics.setValue(min(harmonics, self.sp_harmonics.maximum()))
+    self.ch_notch.setToolTip(f"Filter out a single frequency.\nLine noise detected in the loaded data: {line} Hz with {harmonics} harmonics, the notch filter is set to it.")
+    return line, harmonics
+
+def GetFilterChain(self, quality=30, order=2):
+    """
+    Function to get the filters selected in the Filter data tab as a filter chain.
+
+    Parameters
+    ----------
+    quality : int, optional
+        Quality of the notch filter. Higher value has a narrower frequency filtering. The default is 30.
+    order : int, optional
+        Order of the high/low/band pass filters. Higher order results in a stronger filter. The default is 2.
+
+    Returns
+    -------
+    chain : FilterChain
+        Chain containing the selected filters.
+
+    """
+    chain=FilterChain(self.framerate)
+    if self.ch_notch.isChecked() and self.sp_harmonics.value():
+        chain.harmonics(self.sp_notch.value(), self.sp_harmonics.value(), quality)
+    elif self.ch_notch.isChecked():
+        chain.notch(self.sp_notch.value(), quality)
+    if self.ch_highpass.isChecked() and self.ch_lowpass.isChecked():
+        chain.bandpass([self.filt_highpass, self.filt_lowpass], order)
+    elif self.ch_highpass.isChecked() and not self.ch_lowpass.isChecked():
+        chain.passfilter(self.filt_highpass, "high", order)
+    elif not self.ch_highpass.isChecked() and self.ch_lowpass.isChecked():
+        chain.passfilter(self.filt_lowpass, "low", order)
+    return chain
+
+def ViewFilter(self, quality=30, order=2, preview=False):
     """
     Function to view the selected filters in the Filter data tab.
 
@@ -77,11 +200,13 @@ def ViewFilter(self, quality=30, order=2):
         Quality of the notch filter. Higher value has a narrower frequency filtering. The default is 30.
     order : int, optional
         Order of the high/low/band pass filters. Higher order results in a stronger filter. The default is 2.
+    preview : bool, optional
+        If True, only the time window shown in the unfiltered plot is filtered, up to self.previewsize samples. The default is False.
 
     Returns
     -------
     filtdata : list
-        List containing the filtered data.
+        List containing the filtered data, only of the shown time window for a preview.
     filters : list
         List containing the descriptions of the applied filters.
 
@@ -91,44 +216,37 @@ def ViewFilter(self, quality=30, order=2):
     self.btn_setfilters.setStyleSheet(u"background-color: rgb(93, 93, 93);")
     self.btn_setfilters.repaint()
     size=self.data.shape[0]
-    #Get filter settings and apply filters
-    filtdata=deepcopy(self.data)
-    filters=[]
-    if self.ch_notch.isChecked():
-        #Apply filter
-        filtdata=notchfilter(filtdata, self.framerate, quality, self.sp_notch.value())
-        filters.append(f'Notch filter: {self.sp_notch.value()}; quality: {quality}; order: 2')
-    if self.ch_highpass.isChecked() and self.ch_lowpass.isChecked():
-        #Apply filter
-        filtdata=bandpassfilter(filtdata, self.framerate, order, [self.filt_highpass, self.filt_lowpass])
-        filters.append(f'Bandpass filter: {self.filt_highpass}, {self.filt_lowpass}; order: {order}')
-    elif self.ch_highpass.isChecked() and not self.ch_lowpass.isChecked():
-        #Apply filter
-        filtdata=passfilter(filtdata, self.framerate, order, self.filt_highpass, "high")
-        filters.append(f'Highpass filter: {self.filt_highpass}; order: {order}')
-    elif not self.ch_highpass.isChecked() and self.ch_lowpass.isChecked():
-        #Apply filter
-        filtdata=passfilter(filtdata, self.framerate, order, self.filt_lowpass, "low")
-        filters.append(f'Lowpass filter: {self.filt_lowpass}; order: {order}')
+    #Get filter settings and apply all filters in one pass
+    chain=GetFilterChain(self, quality, order)
+    if preview:
+        #Filter the time window shown in the unfiltered plot, with padding for the filter transients
+        window=self.time.slice(*self.cnvs_unfiltrecording.axs[0].get_xlim()) if self.cnvs_unfiltrecording.axs else slice(0, len(self.time))
+        start=window.start
+        stop=min(max(window.stop, start+1), start+self.previewsize)
+        key=("filter", self.dataversion, self.framerate, tuple(chain.descriptions()), np.dtype(self.dtype).str, start, stop)
+        filtdata=Cached(self, key, chain.applywindow, self.data, start, stop, self.dtype, self.workers)
+        time=self.time[start:stop]
+    else:
+        key=("filter", self.dataversion, self.framerate, tuple(chain.descriptions()), np.dtype(self.dtype).str)
+        filtdata=Cached(self, key, chain.apply, self.data, self.dtype, workers=self.workers)
+        time=self.time
+    filters=chain.descriptions()
     #Plot filtered data
     [axis.remove() for axis in self.cnvs_filtrecording.axs]
     self.cnvs_filtrecording.axs=[]
     self.cnvs_filtrecording.axs=[self.cnvs_filtrecording.fig.add_subplot(size,1,1)]
     [self.cnvs_filtrecording.axs.append(self.cnvs_filtrecording.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_filtrecording.axs[0],sharey=self.cnvs_filtrecording.axs[0])) for ii in range(size-1)]
-    [self.cnvs_filtrecording.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(filtdata)]
+    [self.cnvs_filtrecording.axs[ii].plot(time, chdata, color="k") for ii,chdata in enumerate(filtdata)]
     self.cnvs_filtrecording.fig.text(0.01, 0.5, "Amplitude (A.U.)", va="center", rotation="vertical")
     self.cnvs_filtrecording.fig.text(0.5, 0.02, "Time (s)", ha="center")
-    #Calculate and plot filtered fft
+    #Calculate and plot filtered power spectrum
     [axis.remove() for axis in self.cnvs_filtfft.axs]
     self.cnvs_filtfft.axs=[]
     self.cnvs_filtfft.axs=[self.cnvs_filtfft.fig.add_subplot(size,1,1)]
     [self.cnvs_filtfft.axs.append(self.cnvs_filtfft.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_filtfft.axs[0],sharey=self.cnvs_filtfft.axs[0])) for ii in range(size-1)]
-    for ii,chdata in enumerate(filtdata):
-        ndata=len(chdata)
-        yfft=sp.fft.fft(chdata)
-        xfft=sp.fft.fftfreq(ndata,1/self.framerate)[:ndata//2]
-        self.cnvs_filtfft.axs[ii].plot(xfft, 2.0/ndata*np.abs(yfft[0:ndata//2]), color="k")
-    self.cnvs_filtfft.fig.text(0.01, 0.5, "Power", va="center", rotation="vertical")
+    freqs, psd=Cached(self, ("spectrum", key, self.spectrumsegment), Spectrum, filtdata, self.framerate, self.spectrumsegment, workers=self.workers)
+    [self.cnvs_filtfft.axs[ii].semilogy(freqs, chpsd, color="k") for ii,chpsd in enumerate(psd)]
+    self.cnvs_filtfft.fig.text(0.01, 0.5, "Power spectral density (A.U.²/Hz)", va="center", rotation="vertical")
     self.cnvs_filtfft.fig.text(0.5, 0.02, "Frequency (Hz)", ha="center")
     self.cnvs_filtrecording.draw()
     self.cnvs_filtfft.draw()
@@ -137,20 +255,70 @@ def ViewFilter(self, quality=30, order=2):
     self.btn_setfilters.setEnabled(True)
     return filtdata, filters
 
+def DtypeHistory(self, dtype):
+    """
+    Function to record a change of the data type in the history.
+    The first conversion of integer data to the default np.float64 is not recorded, as it does not change the result of the analysis.
+    Conversions to other data types, and between floating point data types after DtypeChange, are recorded.
+
+    Parameters
+    ----------
+    dtype : dtype
+        Data type of the new data.
+
+    """
+    dtype=np.dtype(dtype)
+    if dtype==self.data.dtype:
+        return
+    if dtype!=np.float64 or np.issubdtype(self.data.dtype, np.floating):
+        self.history.append(f'Data type: {dtype.name}')
+
 def ApplyFilter(self):
     """Function to apply the filters to the stored data."""
     #Update non-filtered plot
     ViewUnfilter(self)
     #Get filtered data
-    self.data, filters=ViewFilter(self)
+    data, filters=ViewFilter(self)
+    #Update history
+    [self.history.append(filt) for filt in filters]
+    DtypeHistory(self, data.dtype)
+    self.data=data
+    self.dataversion+=1
+    if self.ch_resample.isChecked() and self.sp_resample.value()<self.framerate:
+        ApplyResample(self, self.sp_resample.value())
     #Update data select plot
     data, _=ViewDataSel(self)
     if type(data)==bool:
         #Give warning that no channels are selected
         self.WarningMsg("Please select atleast one channel.")
         return
-    #Update history
-    [self.history.append(filt) for filt in filters]
+
+def ApplyResample(self, framerate):
+    """
+    Function to resample the stored data to a lower framerate, see resample.
+    The framerate and time axis are updated, markers and time frames are stored in seconds and stay at the same time.
+    Sorted spikes are moved to the nearest sample at the new framerate.
+
+    Parameters
+    ----------
+    framerate : int
+        New sampling rate of the data.
+
+    """
+    oldframerate=self.framerate
+    data, self.framerate=resample(self.data, oldframerate, framerate, self.dtype, self.workers)
+    self.history.append(f'Resample: {oldframerate} to {self.framerate} Hz')
+    DtypeHistory(self, data.dtype)
+    self.data=data
+    self.dataversion+=1
+    self.clusters=self.clusters.resample(self.framerate, self.data.shape[1])
+    self.time=TimeAxis(self.framerate, self.data.shape[1], self.time[0] if len(self.time) else 0.0)
+    #Markers after the last sample are removed
+    end=self.time[-1] if len(self.time) else 0.0
+    self.markers=defaultdict(list, {key: [mark for mark in item if mark<=end] for key, item in self.markers.items()})
+    self.markers=defaultdict(list, {key: item for key, item in self.markers.items() if item})
+    self.sp_framerate.setValue(int(self.framerate))
+    self.lbl_fileshape.setText(str(self.data.shape))
 
 def UpdateMarkers(self, starttimes, stoptimes, fdata):
     """
@@ -230,13 +398,13 @@ def ViewDataSel(self):
         return False
     #Apply data selections to in function data
     chdata=np.array([chdata[ii] for ii, val in enumerate(channelsel) if val])
-    fdata=np.empty((len(chdata), len(chdata[0])))
+    fdata=np.empty((len(chdata), len(chdata[0])), dtype=self.dtype)
     fdata[:]=np.nan
     for ii,starttime in enumerate(starttimes):
         for jj,chan in enumerate(chdata):
             fdata[jj][int(starttime):int(stoptimes[ii])]=chan[int(starttime):int(stoptimes[ii])]
     if not starttimes:
-        fdata=chdata
+        fdata=chdata.astype(self.dtype, copy=False)
     #Clear plots, and plot data in data selection tab
     size=fdata.shape[0]
     [axis.remove() for axis in self.cnvs_datasel.axs]
@@ -259,7 +427,9 @@ def ApplyDataSel(self):
         #Give warning that no channels are selected
         self.WarningMsg("Please select atleast one channel.")
         return
+    DtypeHistory(self, data.dtype)
     self.data=data
+    self.dataversion+=1
     #Update channel names
     channelsel=[True if cb.isChecked() else False for cb in self.cbs_channels]
     self.channels=np.array([str(self.channels[ii]) for ii, val in enumerate(channelsel) if val])
@@ -293,7 +463,7 @@ def SpikeSortingNoThr(self):
     self.cnvs_spikesort.axs=[]
     self.cnvs_spikesort.axs=[self.cnvs_spikesort.fig.add_subplot(size,1,1)]
     [self.cnvs_spikesort.axs.append(self.cnvs_spikesort.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_spikesort.axs[0],sharey=self.cnvs_spikesort.axs[0])) for ii in range(size-1)]
-    [self.cnvs_spikesort.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(self.data)]
+    [PlotTrace(self.cnvs_spikesort.axs[ii], self.time, self.data, ii) for ii in range(size)]
     
     #Plot markers
     vlines=[]
@@ -328,15 +498,15 @@ def SpikeSort(self, cutoff, recurrence=0.80):
     if cutoff:
         thresholds.append([cutoff, "r"])
     colours=itertools.cycle(TABLEAU_COLORS)
-    for clus in self.clusters[0]:
-        thresholds.append([clus[4][0], next(colours)])
+    for threshold in self.clusters.thresholds[0]:
+        thresholds.append([threshold, next(colours)])
     #Clear plot, then plot data in spike sorting tab
     size=self.data.shape[0]
     [axis.remove() for axis in self.cnvs_spikesort.axs]
     self.cnvs_spikesort.axs=[]
     self.cnvs_spikesort.axs=[self.cnvs_spikesort.fig.add_subplot(size,1,1)]
     [self.cnvs_spikesort.axs.append(self.cnvs_spikesort.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_spikesort.axs[0],sharey=self.cnvs_spikesort.axs[0])) for ii in range(size-1)]
-    [self.cnvs_spikesort.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(self.data)]
+    [PlotTrace(self.cnvs_spikesort.axs[ii], self.time, self.data, ii) for ii in range(size)]
     #Plot markers
     vlines=[]
     colours=itertools.cycle(TABLEAU_COLORS)
@@ -348,9 +518,9 @@ def SpikeSort(self, cutoff, recurrence=0.80):
             [vlines.append([submark,clr]) for submark in self.markers[key]]
     [[self.cnvs_spikesort.axs[ii].axvline(line[0], color=line[1]) for line in vlines] for ii,_ in enumerate(self.data)]
     #Plot clusters
-    for ii, chan in enumerate(self.clusters):
-        for jj, clus in enumerate(chan):
-            self.cnvs_spikesort.axs[ii].scatter(clus[1], clus[3], color=thresholds[jj][1], marker='o', label=f'Cluster {clus[4][0]}')
+    for ii in range(self.clusters.nchannels):
+        for jj, label in enumerate(self.clusters.labels(ii)):
+            self.cnvs_spikesort.axs[ii].scatter(self.clusters.times(ii, jj), self.clusters.markers(ii, jj), color=thresholds[jj][1], marker='o', label=label)
     [self.cnvs_spikesort.axs[ii].legend(frameon=False) for ii, _ in enumerate(self.cnvs_spikesort.axs)]
     self.cnvs_spikesort.fig.text(0.01, 0.5, "Amplitude (A.U.)", va="center", rotation="vertical")
     self.cnvs_spikesort.fig.text(0.5, 0.02, "Time (s)", ha="center")
@@ -359,7 +529,7 @@ def SpikeSort(self, cutoff, recurrence=0.80):
     self.cnvs_spikesortpre.axs=[]
     self.cnvs_spikesortpre.axs=[self.cnvs_spikesortpre.fig.add_subplot(size,1,1)]
     [self.cnvs_spikesortpre.axs.append(self.cnvs_spikesortpre.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_spikesortpre.axs[0],sharey=self.cnvs_spikesortpre.axs[0])) for ii in range(size-1)]
-    [self.cnvs_spikesortpre.axs[ii].plot(self.time, chdata, color="k") for ii,chdata in enumerate(self.data)]
+    [PlotTrace(self.cnvs_spikesortpre.axs[ii], self.time, self.data, ii) for ii in range(size)]
     #Plot markers
     vlines=[]
     for ii,key in enumerate(self.markers.keys()):
@@ -370,10 +540,9 @@ def SpikeSort(self, cutoff, recurrence=0.80):
             [vlines.append([submark,clr]) for submark in self.markers[key]]
     [[self.cnvs_spikesortpre.axs[ii].axvline(line[0], color=line[1]) for line in vlines] for ii,_ in enumerate(self.data)]
     #Plot clusters
-    for ii, chan in enumerate(self.clusters):
-        colours=itertools.cycle(TABLEAU_COLORS)
-        for jj, clus in enumerate(chan):
-            self.cnvs_spikesortpre.axs[ii].scatter(clus[1], clus[2], color=thresholds[jj][1], marker='o')
+    for ii in range(self.clusters.nchannels):
+        for jj in range(self.clusters.nclusters):
+            self.cnvs_spikesortpre.axs[ii].scatter(self.clusters.times(ii, jj), self.clusters.amplitudes(ii, jj), color=thresholds[jj][1], marker='o')
     #Plot thresholds, and cut-off threshold
     for line in thresholds:
         for ii in range(size):
@@ -409,19 +578,17 @@ def AverageWaveform(self, min_val=5, max_val=10):
     colours=itertools.cycle(TABLEAU_COLORS)
     #Set up x-axis points
     wvf_x=np.arange(-min_val, max_val, 1/(self.framerate/1000))
-    for ii, channel in enumerate(self.clusters):
-        for clus in channel:
+    for ii in range(self.clusters.nchannels):
+        for jj, label in enumerate(self.clusters.labels(ii)):
             #Inititiate empty lists for waveform data
             all_wvf_cl=[]
             all_wvf_cl_std=[]
             wvf_y=np.zeros(wvf_x.shape)+np.nan
             #Get y-values for every spike in the cluster
-            for spike in clus[1]:
-                spike=spike[~np.isnan(spike)]
-                if spike.size>0:
-                    wvf_y=self.data[ii][int(spike*self.framerate-(min_val*self.framerate/1000)):int(spike*self.framerate+(max_val*self.framerate/1000))]
-                    if len(wvf_y)==len(wvf_x):
-                        all_wvf_cl.append([wvf_y, 0.5, 0.3, next(colours)])
+            for spike in self.clusters.times(ii, jj):
+                wvf_y=self.data[ii][int(spike*self.framerate-(min_val*self.framerate/1000)):int(spike*self.framerate+(max_val*self.framerate/1000))]
+                if len(wvf_y)==len(wvf_x):
+                    all_wvf_cl.append([wvf_y, 0.5, 0.3, next(colours)])
             #Add mean and standard deviation then plot the data, if there is any
             self.plt_container_averagewaves.append(QtCanvas(self.plt_container_waveforms))
             self.cnvss_averagewave.append(self.plt_container_averagewaves[-1].canvas)
@@ -440,7 +607,7 @@ def AverageWaveform(self, min_val=5, max_val=10):
                 self.cnvss_averagewave[-1].axs[0].text(0.5, 0.6, text[-1],
                                                        horizontalalignment="center",
                                                        verticalalignment="center")
-            self.plt_container_waveforms.addTab(self.plt_container_averagewaves[-1], f'{self.fulldata["Channels"][ii]} Cluster {clus[4][0]}')
+            self.plt_container_waveforms.addTab(self.plt_container_averagewaves[-1], f'{self.fulldata["Channels"][ii]} {label}')
             self.cnvss_averagewave[-1].fig.text(0.01, 0.5, "Amplitude (A.U.)", va="center", rotation="vertical")
             self.cnvss_averagewave[-1].fig.text(0.5, 0.02, "Time (ms)", ha="center")
             self.cnvss_averagewave[-1].draw()
@@ -459,7 +626,7 @@ def InterSpikeInterval(self):
     self.cnvs_isi.axs=[self.cnvs_isi.fig.add_subplot(size,1,1)]
     [self.cnvs_isi.axs.append(self.cnvs_isi.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_isi.axs[0],sharey=self.cnvs_isi.axs[0])) for ii in range(size-1)]
     #Extract timestamps of spikes and convert them to milliseconds
-    spike_times=[[[x*1000 for x in cl[1] if ~np.isnan(x)] for cl in chan] for chan in self.clusters]
+    spike_times=[[self.clusters.times(ii, jj)*1000 for jj in range(self.clusters.nclusters)] for ii in range(self.clusters.nchannels)]
     #Interspike intervals
     isispike_times=[[np.diff(cl) for cl in chan] for chan in spike_times]
     #Create bins and weights if there are any values
@@ -473,7 +640,7 @@ def InterSpikeInterval(self):
         colours=itertools.cycle(TABLEAU_COLORS)
         for jj, spikeset in enumerate(chan):
             if len(spikeset):
-                self.cnvs_isi.axs[ii].hist(spikeset, bins, weights=weights[ii][jj], color=next(colours), alpha=0.5, label=f'{self.fulldata["Channels"][ii]} Cluster {self.clusters[ii][jj][4][0]}', ec='black')
+                self.cnvs_isi.axs[ii].hist(spikeset, bins, weights=weights[ii][jj], color=next(colours), alpha=0.5, label=f'{self.fulldata["Channels"][ii]} {self.clusters.labels(ii)[jj]}', ec='black')
                 self.cnvs_isi.axs[ii].set_xscale('log')
                 self.cnvs_isi.axs[ii].legend(frameon=False)
                 self.cnvs_isi.fig.text(0.01, 0.5, "Normalised distribution", va="center", rotation="vertical")
@@ -494,7 +661,7 @@ def AmplitudeDistribution(self):
     self.cnvs_amplitudedis.axs=[self.cnvs_amplitudedis.fig.add_subplot(size,1,1)]
     [self.cnvs_amplitudedis.axs.append(self.cnvs_amplitudedis.fig.add_subplot(size,1,ii+2,sharex=self.cnvs_amplitudedis.axs[0],sharey=self.cnvs_amplitudedis.axs[0])) for ii in range(size-1)]
     #Extract peak heights
-    spike_amp_cl = [[[x for x in cl[2] if ~np.isnan(x)] for cl in chan] for chan in self.clusters]
+    spike_amp_cl=[[self.clusters.amplitudes(ii, jj) for jj in range(self.clusters.nclusters)] for ii in range(self.clusters.nchannels)]
     #Create bins and weights if there are any values
     if any([any([any(cl) for cl in chan]) for chan in spike_amp_cl]):
         maxval=[[max(cl, default=100) for cl in chan] for chan in spike_amp_cl]
@@ -508,7 +675,7 @@ def AmplitudeDistribution(self):
         colours=itertools.cycle(TABLEAU_COLORS)
         for jj, spikeset in enumerate(chan):
             if len(spikeset):
-                self.cnvs_amplitudedis.axs[ii].hist(spikeset, bins, weights=weights[ii][jj], color=next(colours), alpha=0.5, label=f'{self.fulldata["Channels"][ii]} Cluster {self.clusters[ii][jj][4][0]}', ec='black')
+                self.cnvs_amplitudedis.axs[ii].hist(spikeset, bins, weights=weights[ii][jj], color=next(colours), alpha=0.5, label=f'{self.fulldata["Channels"][ii]} {self.clusters.labels(ii)[jj]}', ec='black')
                 self.cnvs_amplitudedis.axs[ii].legend(frameon=False)
                 self.cnvs_amplitudedis.fig.text(0.01, 0.5, "Normalised distribution", va="center", rotation="vertical")
                 self.cnvs_amplitudedis.fig.text(0.5, 0.02, "Amplitude distribution (A.U.)", ha="center")
@@ -570,7 +737,7 @@ def AutoCorrelation(self):
     #Get window time value
     intervalsize=self.dsp_autotime.value()
     #Extract timestamps of spikes and convert to location
-    spike_times=[[[x*1000 for x in cl[1] if ~np.isnan(x)] for cl in chan] for chan in self.clusters]
+    spike_times=[[self.clusters.times(ii, jj)*1000 for jj in range(self.clusters.nclusters)] for ii in range(self.clusters.nchannels)]
     #Calculate the autocorrelation per cluster per channel
     autocorr = [[cross_correlate(spikeset, spikeset, intervalsize*1000, self.autocorr_bincount) for spikeset in chan] for chan in spike_times]
     peakcounts=[[0 for cl in chan] for chan in autocorr]
@@ -586,7 +753,7 @@ def AutoCorrelation(self):
                 self.plt_container_autocorrs.append(QtCanvas(self.plt_container_autocorr))
                 self.cnvss_autocorr.append(self.plt_container_autocorrs[-1].canvas)
                 self.cnvss_autocorr[-1].axs=[self.cnvss_autocorr[-1].fig.add_subplot(1,1,1)]
-                self.plt_container_autocorr.addTab(self.plt_container_autocorrs[-1], f'{self.fulldata["Channels"][ii]} Cluster {self.clusters[ii][jj][4][0]}')
+                self.plt_container_autocorr.addTab(self.plt_container_autocorrs[-1], f'{self.fulldata["Channels"][ii]} {self.clusters.labels(ii)[jj]}')
                 #change x values to corresponding bin sizes when bins are implemented
                 self.cnvss_autocorr[-1].axs[0].plot(np.arange(0, spikeset.size/2-1), spikeset[int(spikeset.size/2):-1], color="k")
                 self.cnvss_autocorr[-1].fig.text(0.01, 0.5, "# of spikes", va="center", rotation="vertical")
@@ -614,18 +781,18 @@ def CrossCorrelation(self):
     intervalsize=self.dsp_crosstime.value()
     #Get cross-correlation clusters
     if "Marker" in self.cb_crossch1.currentText():
-        spikeset1=self.markers[float(self.cb_crossch1.currentText().split("Marker ")[-1])]
+        spikeset1=self.markers[self.cb_crossch1.currentText().split("Marker ", 1)[-1]]
         spikeset1=np.array([spike*1000 for spike in spikeset1])
     else:
-        clusterlist=np.array([f'Cluster {clus[4][0]}' for clus in self.clusters[0]])
+        clusterlist=np.array(self.clusters.labels())
         channelindx=np.where(self.channels==self.cb_crossch1.currentText())[0][0]
         clusterindx=np.where(clusterlist==self.cb_crosscl1.currentText())[0][0]
-        spikeset1=np.array([x*1000 for x in self.clusters[channelindx][clusterindx][1] if ~np.isnan(x)])
+        spikeset1=self.clusters.times(channelindx, clusterindx)*1000
     #Get cluster indices
-    clusterlist=np.array([f'Cluster {clus[4][0]}' for clus in self.clusters[0]])
+    clusterlist=np.array(self.clusters.labels())
     channelindx=np.where(self.channels==self.cb_crossch2.currentText())[0][0]
     clusterindx=np.where(clusterlist==self.cb_crosscl2.currentText())[0][0]
-    spikeset2=np.array([x*1000 for x in self.clusters[channelindx][clusterindx][1] if ~np.isnan(x)])
+    spikeset2=self.clusters.times(channelindx, clusterindx)*1000
     #Calculate cross-correlation
     #Add preinterval
     cross_corr=cross_correlate(spikeset1, spikeset2, intervalsize*1000, self.crosscorr_bincount)
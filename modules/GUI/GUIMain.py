@@ -20,14 +20,15 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import sys
 import os
 import numpy as np
-import pandas as pd
 from collections import defaultdict
 from decimal import Decimal, ROUND_HALF_UP
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QSpinBox, QFileDialog,
                              QCheckBox, QLabel, QDoubleSpinBox, QMessageBox)
 from modules.GUI.Ui_SpikeAnalysis import Ui_MainWindow
 from modules.GUI import GUIFunctions
-from modules.analysis import SpikeFunctions
+from modules.GUI.ResultCache import ResultCache
+from modules.analysis import SpikeFunctions, ExportFunctions
+from modules.analysis.SpikeTable import SpikeTable
  
 class Main(QMainWindow, Ui_MainWindow):
     def __init__(self):
@@ -37,6 +38,25 @@ class Main(QMainWindow, Ui_MainWindow):
         self.exitcode=0
         #File name
         self.filename=""
+        #Memory-map .wav files instead of reading them into memory
+        self.memorymap=True
+        #Number of samples per block when streaming over the data
+        self.blocksize=1000000
+        #Data type of filtered and selected data, float32 halves the memory use
+        self.dtype=np.float64
+        #Number of threads to filter channels in parallel
+        self.workers=os.cpu_count()
+        #Maximum number of samples that are filtered for the filter preview
+        self.previewsize=2000000
+        #Number of samples per segment of the power spectrum
+        self.spectrumsegment=8192
+        #Cache of spectra and filtered data, the data version changes every time the data changes
+        self.dataversion=0
+        self.cache=ResultCache(budget=512*2**20)
+        #Peak detection backend for spike sorting, None for the fastest available backend
+        self.peakbackend=None
+        #Spike sorting method, "legacy" for one pass per threshold or "single" to find the spikes of all thresholds in one pass, set in the menu
+        self.sortmethod="legacy"
         #Filters
         self.filt_highpass=1
         self.filt_lowpass=500
@@ -73,7 +93,7 @@ class Main(QMainWindow, Ui_MainWindow):
         self.datatype=""
         self.data=[]
         self.time=[]
-        self.clusters=[]
+        self.clusters=SpikeTable.empty()
         self.markers=defaultdict(list)
         self.framerate=0
         self.history=[]
@@ -110,7 +130,7 @@ class Main(QMainWindow, Ui_MainWindow):
         self.btn_import.clicked.connect(lambda: self.LoadData(True))
         self.actionImport_file.triggered.connect(lambda: self.LoadData(False))
         self.btn_savefilt.clicked.connect(lambda: self.SaveData("filt"))
-        self.btn_setfilters.clicked.connect(lambda: GUIFunctions.ViewFilter(self))
+        self.btn_setfilters.clicked.connect(lambda: GUIFunctions.ViewFilter(self, preview=True))
         self.btn_applyfilt.clicked.connect(self.ApplyFilters)
         self.btn_savedatasel.clicked.connect(lambda: self.SaveData("datasel"))
         self.btn_viewdatasel.clicked.connect(lambda: GUIFunctions.ViewDataSel(self))
@@ -138,6 +158,8 @@ class Main(QMainWindow, Ui_MainWindow):
         self.actionBatch_analysis.triggered.connect(self.BatchWindow)
         self.Btn_Exit.clicked.connect(self.close)
         self.actionReset.triggered.connect(self.Reset)
+        self.actionFloat32.toggled.connect(self.DtypeChange)
+        self.actionSinglePass.toggled.connect(self.SortMethodChange)
         
         #Set labels
         self.lbl_order.setText(str(self.order))
@@ -230,11 +252,7 @@ class Main(QMainWindow, Ui_MainWindow):
         filedialog.setNameFilters(["Text file (*.txt)"])
         if filedialog.exec():
             file=filedialog.selectedFiles()[0]
-            with open(file, encoding="utf8") as csvfile:
-                markersCSV=np.genfromtxt(csvfile, delimiter=',')
-            self.markers=defaultdict(list)
-            for key in markersCSV:
-                self.markers[key[0]].append(key[1])
+            self.markers=SpikeFunctions.MarkerDict(*SpikeFunctions.ReadMarkers(file))
             starttimes=[]
             stoptimes=[]
             for his in self.history:
@@ -282,14 +300,18 @@ class Main(QMainWindow, Ui_MainWindow):
         self.btn_import.repaint()
         filedialog=QFileDialog(self)
         filedialog.setWindowTitle("Open file...")
-        filedialog.setNameFilters(["All (*.npz *.wav)","Numpy archive (*.npz)", "Audio file (*.wav)"])
+        filedialog.setNameFilters(["All (*.npz *.wav *.mrz)","Numpy archive (*.npz)", "Audio file (*.wav)", "Multi-resolution archive (*.mrz)"])
         if filedialog.exec():
             self.btn_loadmarkers.setEnabled(True)
             self.btn_loadmarkers_2.setEnabled(True)
             file=filedialog.selectedFiles()[0]
             self.filename=file.split("/")[-1]
             direc=os.path.dirname(file)
-            self.data, self.clusters, self.markers, self.time, self.framerate, self.datatype, self.history, self.identifier, self.channels, nomarker=SpikeFunctions.OpenRecording(direc, self.filename)
+            previous=[self.data, self.fulldata["Data"]]
+            self.data, self.clusters, self.markers, self.time, self.framerate, self.datatype, self.history, self.identifier, self.channels, nomarker=SpikeFunctions.OpenRecording(direc, self.filename, self.memorymap)
+            #Close the file of a previously loaded multi-resolution archive, also if the data was filtered since
+            [data.close() for data in previous if hasattr(data, "close")]
+            self.dataversion+=1
             self.history=list(self.history)
             if nomarker:
                 self.lbl_markersloaded.setText("No markers")            
@@ -302,13 +324,19 @@ class Main(QMainWindow, Ui_MainWindow):
             self.lbl_datatype.setText(str(self.datatype))
             self.le_identifier.setText(str(self.identifier))
             self.cb_channelsnr.clear()
-            for ii,ch in enumerate(self.data):
-                m = ch.mean(0)
-                sd = ch.std(axis=0, ddof=0)
+            if hasattr(self.data, "statistics"):
+                #Multi-resolution archives store the statistics per channel
+                mean, std=self.data.statistics()
+            else:
+                #Stream over the data in blocks, so memory-mapped recordings are not loaded as a whole
+                mean, std, _, _=SpikeFunctions.BlockStatistics(SpikeFunctions.IterBlocks(self.data, self.blocksize))
+            for ii,(m, sd) in enumerate(zip(mean, std)):
                 SNR=abs(np.where(sd == 0, 0, m/sd))
                 SNRtxt=Decimal(str(SNR))
                 SNRtxt=SNRtxt.quantize(Decimal('0.0001'), ROUND_HALF_UP) #Proper rounding
                 self.cb_channelsnr.addItem(f'Channel {ii+1}: {SNRtxt}')
+            #Set the notch filter to the line noise in a sample of the data
+            GUIFunctions.DetectLineNoise(self)
             self.fulldata={"Datatype": self.datatype,
                            "Data": self.data,
                            "Framerate": self.framerate,
@@ -330,10 +358,17 @@ class Main(QMainWindow, Ui_MainWindow):
             #Plot raw data in open recording tab, filters tab, and data selection tab
             if plotloadeddata:
                 GUIFunctions.ViewRaw(self)
-                GUIFunctions.ViewUnfilter(self)
-                GUIFunctions.ViewDataSel(self)
+                #The filter and data selection plots need the full data, they are plotted for multi-resolution archives when used
+                if not hasattr(self.data, "envelope"):
+                    GUIFunctions.ViewUnfilter(self)
+                    GUIFunctions.ViewDataSel(self)
+                else:
+                    #Remove the plot of the previous file, so the filter preview does not use its time window
+                    [axis.remove() for axis in self.cnvs_unfiltrecording.axs]
+                    self.cnvs_unfiltrecording.axs=[]
+                    self.cnvs_unfiltrecording.draw()
                 GUIFunctions.SpikeSortingNoThr(self)
-                if len(self.clusters)!=0:
+                if self.clusters.nclusters:
                     cutoff_thresh=False
                     recurrence=0.80
                     for his in self.history:
@@ -482,17 +517,20 @@ class Main(QMainWindow, Ui_MainWindow):
         else:
             cutoff_thresh=False
         #Get spike data and sort into clusters
-        self.clusters=SpikeFunctions.SpikeSorting(self.data, thresholds, self.dsp_recurrence.value(), self.framerate, self.time, cutoff_thresh)
+        backend, _=SpikeFunctions.PeakBackend(self.peakbackend)
+        self.clusters=SpikeFunctions.SpikeSorting(self.data, thresholds, self.dsp_recurrence.value(), self.framerate, self.time, cutoff_thresh, backend, self.sortmethod)
         #Plot spike sorting
         GUIFunctions.SpikeSort(self, cutoff_thresh, self.dsp_recurrence.value())
         self.CrosscorrSelectChange1()
         self.CrosscorrSelectChange2()
         #Update history
-        thresholds=[str(clus[4][0]) for clus in self.clusters[0]]
+        thresholds=[str(threshold) for threshold in self.clusters.thresholds[0]]
         if cutoff_thresh:
             self.history.append(f'Spike sorting cut-off: {cutoff_thresh}')
         self.history.append(f'Spike sorting thresholds: {", ".join(thresholds)}')
         self.history.append(f'Spike sorting recurrence: {self.dsp_recurrence.value()}')
+        self.history.append(f'Spike sorting method: {self.sortmethod}')
+        self.history.append(f'Spike detection backend: {backend}')
         #Enable save buttons
         self.btn_savespikes.setEnabled(True)
         self.btn_exportcsv.setEnabled(True)
@@ -529,18 +567,11 @@ class Main(QMainWindow, Ui_MainWindow):
         self.btn_savespikes.repaint()
         filedialog=QFileDialog(self)
         filedialog.setWindowTitle("Save file as...")
-        filedialog.setNameFilter("Numpy archive (*.npz)")
+        filedialog.setNameFilters(["Numpy archive (*.npz)", "Multi-resolution archive (*.mrz)"])
         filedialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
         filedialog.selectFile(f'{self.filename[:-4]}_{extension}')
         if filedialog.exec():
             file=filedialog.selectedFiles()[0]
-            savehis=np.empty(len(self.history), dtype=type(np.array))
-            maxhislen=0
-            for his in self.history:
-                if len(str(his))>maxhislen:
-                    maxhislen=len(str(his))
-            for ii, _ in enumerate(self.history):
-                savehis[ii]=np.array(self.history[ii], dtype=f'U{maxhislen}')
             self.fulldata={"Datatype": self.datatype,
                            "Data": self.data,
                            "Framerate": self.framerate,
@@ -550,7 +581,10 @@ class Main(QMainWindow, Ui_MainWindow):
                            "History": self.history,
                            "Channels": self.channels,
                            "Identifier": self.identifier}
-            np.savez(file, allow_pickle=True, **self.fulldata)
+            if file.endswith(".mrz") or "mrz" in filedialog.selectedNameFilter():
+                SpikeFunctions.SaveChunked(file, self.data, self.clusters, self.markers, self.time, self.framerate, self.datatype, self.history, self.identifier, self.channels)
+            else:
+                SpikeFunctions.SaveSession(file, self.data, self.clusters, self.markers, self.time, self.framerate, self.datatype, self.history, self.identifier, self.channels)
             print("data saved")
         self.btn_savefilt.setStyleSheet(u"background-color: rgb(0, 255, 0);")
         self.btn_savefilt.setEnabled(True)
@@ -565,7 +599,11 @@ class Main(QMainWindow, Ui_MainWindow):
         self.btn_exportcsv.repaint()
         filedialog=QFileDialog(self)
         filedialog.setWindowTitle("Save file as...")
-        filedialog.setNameFilter("Comma seperated file (*.csv)")
+        #The binary formats are much faster than csv for many spikes
+        filters=["Comma seperated file (*.csv)", "Numpy column folder, fast for many spikes (*)"]
+        if ExportFunctions.pa is not None:
+            filters.append("Arrow IPC file, fast for many spikes (*.arrow)")
+        filedialog.setNameFilters(filters)
         filedialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
         filedialog.selectFile(f'{self.filename[:-4]}_spikesorted')
         if filedialog.exec():
@@ -579,21 +617,24 @@ class Main(QMainWindow, Ui_MainWindow):
                            "Channels": self.channels,
                            "Identifier": self.identifier}
             file=filedialog.selectedFiles()[0]
-            #Create dataframe with first column containing file info
-            fdf=pd.DataFrame({"File info": [self.datatype, self.framerate, self.identifier]+self.history})
-            #Add a columns per cluster with timestamps of spikes
-            for ii,channel in enumerate(self.clusters):
-                for clus in channel:
-                    sdf=pd.DataFrame({f'{self.fulldata["Channels"][ii]} Cluster {clus[4][0]}': clus[1][~np.isnan(clus[1])]})
-                    fdf=pd.concat([fdf,sdf], axis=1)
-            fdf.to_csv(file, index=False)
+            fileformat={"Numpy": "npy", "Arrow": "arrow"}.get(filedialog.selectedNameFilter().split(" ")[0], "csv")
+            #Write one row per spike, with the file info as metadata
+            ExportFunctions.ExportSpikes(file, self.clusters, self.channels, self.framerate, [self.datatype, self.framerate, self.identifier]+self.history, fileformat)
         self.btn_exportcsv.setStyleSheet(u"background-color: rgb(0, 255, 0);")
         self.btn_exportcsv.setEnabled(True)
     
     def FramerateChange(self):
         """Method to update the framerate."""
         self.framerate=self.sp_framerate.value()
+
+    def DtypeChange(self):
+        """Method to update the data type of filtered and selected data."""
+        self.dtype=np.float32 if self.actionFloat32.isChecked() else np.float64
         
+    def SortMethodChange(self):
+        """Method to update the spike sorting method."""
+        self.sortmethod="single" if self.actionSinglePass.isChecked() else "legacy"
+
     def HighpassChange(self):
         """Method to update the high-pass filter"""
         self.filt_highpass=self.sp_bandpasshigh.value()
@@ -603,20 +644,20 @@ class Main(QMainWindow, Ui_MainWindow):
     
     def CrosscorrSelectChange1(self):
         """Method to update the selectable clusters based on the selected channel of the first cluster."""
-        if len(self.clusters)==0:
+        if not self.clusters.nclusters:
             return
         self.cb_crossch1.currentTextChanged.disconnect()
         self.cb_crosscl1.clear()
         if "Marker" not in self.cb_crossch1.currentText():
-            self.cb_crosscl1.addItems([f'Cluster {clus[4][0]}' for clus in self.clusters[0]])
+            self.cb_crosscl1.addItems(self.clusters.labels())
         self.cb_crossch1.currentTextChanged.connect(self.CrosscorrSelectChange1)
     def CrosscorrSelectChange2(self):
         """Method to update the selectable clusters based on the selected channel of the second cluster."""
-        if len(self.clusters)==0:
+        if not self.clusters.nclusters:
             return
         self.cb_crossch2.currentTextChanged.disconnect()
         self.cb_crosscl2.clear()
-        self.cb_crosscl2.addItems([f'Cluster {clus[4][0]}' for clus in self.clusters[0]])
+        self.cb_crosscl2.addItems(self.clusters.labels())
         self.cb_crossch2.currentTextChanged.connect(self.CrosscorrSelectChange2)
     
     def WarningMsg(self, text, subtext=""):
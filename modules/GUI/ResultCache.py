@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from collections import OrderedDict
+
+
+def _nbytes(value):
+    """Function to get the number of bytes of the arrays in a result, also inside tuples and lists."""
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+class ResultCache:
+    """
+    Least recently used cache for results such as spectra and filtered data.
+    Keys should contain the data version of the GUI, so results of changed data are not used.
+    The least recently used results are removed when the arrays in the cache take more bytes than the budget.
+    """
+    def __init__(self, budget=512*2**20):
+        """
+        Parameters
+        ----------
+        budget : int, optional
+            Maximum number of bytes of all cached arrays. The default is 512 MiB.
+
+        """
+        self.budget=budget
+        self.nbytes=0
+        self.entries=OrderedDict()
+
+    def get(self, key):
+        """Method to get a cached result, or None if it is not cached."""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value):
+        """Method to store a result, results larger than the budget are not stored."""
+        size=_nbytes(value)
+        if key in self.entries:
+            self.nbytes-=self.entries.pop(key)[1]
+        if size>self.budget:
+            return
+        while self.entries and self.nbytes+size>self.budget:
+            self.nbytes-=self.entries.popitem(last=False)[1][1]
+        self.entries[key]=(value, size)
+        self.nbytes+=size
+
+    def clear(self):
+        """Method to remove all results."""
+        self.entries.clear()
+        self.nbytes=0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"ResultCache({len(self.entries)} results, {self.nbytes} of {self.budget} bytes)"
@@ -38,6 +38,12 @@ class Ui_MainWindow(object):
         self.actionFile_history.setObjectName(u"actionFile_history")
         self.actionReset = QAction(MainWindow)
         self.actionReset.setObjectName(u"actionReset")
+        self.actionFloat32 = QAction(MainWindow)
+        self.actionFloat32.setObjectName(u"actionFloat32")
+        self.actionFloat32.setCheckable(True)
+        self.actionSinglePass = QAction(MainWindow)
+        self.actionSinglePass.setObjectName(u"actionSinglePass")
+        self.actionSinglePass.setCheckable(True)
         self.centralwidget = QWidget(MainWindow)
         self.centralwidget.setObjectName(u"centralwidget")
         self.gridLayout_13 = QGridLayout(self.centralwidget)
@@ -249,6 +255,31 @@ class Ui_MainWindow(object):
 
         self.formLayout.setWidget(4, QFormLayout.FieldRole, self.lbl_quality)
 
+        self.label_harmonics = QLabel(self.widget)
+        self.label_harmonics.setObjectName(u"label_harmonics")
+
+        self.formLayout.setWidget(5, QFormLayout.LabelRole, self.label_harmonics)
+
+        self.sp_harmonics = QSpinBox(self.widget)
+        self.sp_harmonics.setObjectName(u"sp_harmonics")
+        self.sp_harmonics.setMaximum(50)
+        self.sp_harmonics.setValue(0)
+
+        self.formLayout.setWidget(5, QFormLayout.FieldRole, self.sp_harmonics)
+
+        self.ch_resample = QCheckBox(self.widget)
+        self.ch_resample.setObjectName(u"ch_resample")
+
+        self.formLayout.setWidget(6, QFormLayout.LabelRole, self.ch_resample)
+
+        self.sp_resample = QSpinBox(self.widget)
+        self.sp_resample.setObjectName(u"sp_resample")
+        self.sp_resample.setMinimum(1)
+        self.sp_resample.setMaximum(999999)
+        self.sp_resample.setValue(5000)
+
+        self.formLayout.setWidget(6, QFormLayout.FieldRole, self.sp_resample)
+
 
         self.gridLayout_3.addWidget(self.widget, 0, 0, 1, 1)
 
@@ -694,6 +725,7 @@ class Ui_MainWindow(object):
         self.menubar.setGeometry(QRect(0, 0, 800, 22))
         self.menuMenu = QMenu(self.menubar)
         self.menuMenu.setObjectName(u"menuMenu")
+        self.menuMenu.setToolTipsVisible(True)
         MainWindow.setMenuBar(self.menubar)
 
         self.menubar.addAction(self.menuMenu.menuAction())
@@ -701,6 +733,8 @@ class Ui_MainWindow(object):
         self.menuMenu.addAction(self.actionBatch_analysis)
         self.menuMenu.addSeparator()
         self.menuMenu.addAction(self.actionFile_history)
+        self.menuMenu.addAction(self.actionFloat32)
+        self.menuMenu.addAction(self.actionSinglePass)
         self.menuMenu.addSeparator()
         self.menuMenu.addAction(self.actionReset)
 
@@ -720,6 +754,11 @@ class Ui_MainWindow(object):
         self.actionBatch_analysis.setText(QCoreApplication.translate("MainWindow", u"Batch analysis", None))
         self.actionFile_history.setText(QCoreApplication.translate("MainWindow", u"File history", None))
         self.actionReset.setText(QCoreApplication.translate("MainWindow", u"Reset", None))
+        self.actionFloat32.setText(QCoreApplication.translate("MainWindow", u"Process in float32", None))
+        self.actionSinglePass.setText(QCoreApplication.translate("MainWindow", u"Sort spikes in one pass", None))
+#if QT_CONFIG(tooltip)
+        self.actionSinglePass.setToolTip(QCoreApplication.translate("MainWindow", u"Find the spikes of all thresholds in one faster pass. Spikes are put in the cluster of the highest threshold their height reaches, so a few spikes can differ from sorting per threshold.", None))
+#endif // QT_CONFIG(tooltip)
 #if QT_CONFIG(tooltip)
         self.tabWidget.setToolTip("")
 #endif // QT_CONFIG(tooltip)
@@ -788,6 +827,16 @@ class Ui_MainWindow(object):
         self.lbl_order.setText("")
         self.label_19.setText(QCoreApplication.translate("MainWindow", u"Quality (notch)", None))
         self.lbl_quality.setText("")
+#if QT_CONFIG(tooltip)
+        self.label_harmonics.setToolTip(QCoreApplication.translate("MainWindow", u"Number of multiples of the notch frequency that are also filtered out, in the same pass.\n"
+"Default is 0.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label_harmonics.setText(QCoreApplication.translate("MainWindow", u"Harmonics (notch)", None))
+#if QT_CONFIG(tooltip)
+        self.ch_resample.setToolTip(QCoreApplication.translate("MainWindow", u"Resample the data to a lower framerate when the filters are applied, frequencies above half of the new framerate are filtered out.", None))
+#endif // QT_CONFIG(tooltip)
+        self.ch_resample.setText(QCoreApplication.translate("MainWindow", u"Resample", None))
+        self.sp_resample.setSuffix(QCoreApplication.translate("MainWindow", u" Hz", None))
 #if QT_CONFIG(tooltip)
         self.btn_applyfilt.setToolTip(QCoreApplication.translate("MainWindow", u"Apply the filters to the stored data.\n"
 "Note that after time frames have been applied in data selection, filters are no longer applicable.", None))
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import zipfile
+import numpy as np
+from collections import OrderedDict
+
+
+def _membername(level, kind, channel, chunk):
+    """Function to get the name of a chunk in the .mrz file."""
+    return f"Level{level}_{kind}_{channel}_{chunk}"
+
+def WriteChunked(file, data, arrays, chunksize=262144, factor=16, minsize=4096):
+    """
+    Function to write data to a multi-resolution chunked .mrz file.
+    Every channel is stored in compressed chunks, together with levels of minimum and maximum values.
+    Every level combines factor values of the level below it, until the level has at most minsize values.
+    The data is read one chunk at a time, so it can be memory-mapped.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file to save to.
+    data : Array
+        Array containing y-values per channel.
+    arrays : dict
+        Dictionary with other typed arrays to store in the file, e.g. the session information.
+    chunksize : int, optional
+        Number of values per chunk. Must be a multiple of factor. The default is 262144.
+    factor : int, optional
+        Number of values of a level that are combined into one value of the next level. The default is 16.
+    minsize : int, optional
+        Maximum number of values of the highest level. The default is 4096.
+
+    """
+    nchannels, nframes=np.shape(data)
+    levelsizes=[nframes]
+    while levelsizes[-1]>minsize:
+        levelsizes.append(-(-levelsizes[-1]//factor))
+    statistics=np.zeros((2, nchannels))
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=1) as zf:
+        def write(name, array):
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asarray(array), allow_pickle=False)
+        for channel in range(nchannels):
+            #Values of every level that still have to be written, a chunk at a time
+            pending=[[np.empty(0, data.dtype), np.empty(0, data.dtype)] for _ in levelsizes]
+            written=[0 for _ in levelsizes]
+            def push(level, mins, maxs, final=False):
+                pending[level]=[np.concatenate((pending[level][0], mins)), np.concatenate((pending[level][1], maxs))]
+                while len(pending[level][0])>=chunksize or (final and len(pending[level][0])):
+                    chunkmins, chunkmaxs=pending[level][0][:chunksize], pending[level][1][:chunksize]
+                    pending[level]=[pending[level][0][chunksize:], pending[level][1][chunksize:]]
+                    write(_membername(level, "min", channel, written[level]), chunkmins)
+                    write(_membername(level, "max", channel, written[level]), chunkmaxs)
+                    written[level]+=1
+                    if level+1<len(levelsizes):
+                        groups=np.arange(0, len(chunkmins), factor)
+                        push(level+1, np.fmin.reduceat(chunkmins, groups), np.fmax.reduceat(chunkmaxs, groups))
+                if final and level+1<len(levelsizes):
+                    push(level+1, pending[level][0][:0], pending[level][1][:0], final)
+            count=mean=sqdev=0
+            for kk, start in enumerate(range(0, nframes, chunksize)):
+                chunk=np.asarray(data[channel][start:start+chunksize])
+                write(_membername(0, "data", channel, kk), chunk)
+                #Combine the mean and squared deviations of the chunk with those of the previous chunks
+                values=chunk[~np.isnan(chunk)] if chunk.dtype.kind=="f" else chunk
+                if len(values):
+                    chunkmean=np.mean(values, dtype=np.float64)
+                    delta=chunkmean-mean
+                    sqdev+=np.sum((values-chunkmean)**2, dtype=np.float64)+delta**2*count*len(values)/(count+len(values))
+                    mean+=delta*len(values)/(count+len(values))
+                    count+=len(values)
+                if len(levelsizes)>1:
+                    groups=np.arange(0, len(chunk), factor)
+                    push(1, np.fmin.reduceat(chunk, groups), np.fmax.reduceat(chunk, groups))
+            if len(levelsizes)>1:
+                push(1, pending[1][0][:0], pending[1][1][:0], final=True)
+            statistics[0][channel]=mean if count else np.nan
+            statistics[1][channel]=np.sqrt(sqdev/count) if count else np.nan
+        write("ChunkSize", np.array(chunksize))
+        write("LevelFactor", np.array(factor))
+        write("LevelSizes", np.array(levelsizes, dtype=np.int64))
+        write("DataShape", np.array([nchannels, nframes], dtype=np.int64))
+        write("DataType", np.array(np.dtype(data.dtype).str))
+        write("ChannelMean", statistics[0])
+        write("ChannelStd", statistics[1])
+        for key, array in arrays.items():
+            write(key, array)
+
+
+class ChunkedRecording:
+    """
+    Recording stored in a multi-resolution chunked .mrz file, made by WriteChunked.
+    It behaves like the read-only array of y-values per channel, but only decompresses the chunks that are used.
+    Minimum and maximum values over longer time ranges are read from the stored levels, for plotting long recordings.
+    """
+    def __init__(self, file, cachesize=64):
+        """
+        Parameters
+        ----------
+        file : String
+            Path of the .mrz file.
+        cachesize : int, optional
+            Number of decompressed chunks that are kept in memory. The default is 64.
+
+        """
+        self.file=file
+        self.cachesize=cachesize
+        self.open()
+
+    def open(self):
+        """Method to open the file, also to open it again after close."""
+        self.npzfile=np.load(self.file)
+        self.chunksize=int(self.npzfile["ChunkSize"])
+        self.factor=int(self.npzfile["LevelFactor"])
+        self.levelsizes=self.npzfile["LevelSizes"]
+        self.shape=tuple(int(val) for val in self.npzfile["DataShape"])
+        self.dtype=np.dtype(str(self.npzfile["DataType"]))
+        self.ndim=2
+        self.size=self.shape[0]*self.shape[1]
+        self.cache=OrderedDict()
+
+    def close(self):
+        """Method to close the file and remove the cached chunks, the recording can not be read until it is opened again."""
+        if self.npzfile is not None:
+            self.npzfile.close()
+            self.npzfile=None
+        self.cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def statistics(self):
+        """Method to get the mean and standard deviation per channel, calculated when the file was written."""
+        return self.npzfile["ChannelMean"], self.npzfile["ChannelStd"]
+
+    def _chunk(self, level, kind, channel, chunk):
+        """Method to get a decompressed chunk, using the cache of recently used chunks."""
+        key=(level, kind, channel, chunk)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key]=self.npzfile[_membername(*key)]
+            if len(self.cache)>self.cachesize:
+                self.cache.popitem(last=False)
+        return self.cache[key]
+
+    def read(self, channel, start, stop, level=0, kind="data"):
+        """
+        Method to read a range of values of a channel.
+
+        Parameters
+        ----------
+        channel : int
+            Index of the channel.
+        start : int
+            Index of the first value.
+        stop : int
+            Index after the last value.
+        level : int, optional
+            Level to read from, 0 are the samples themselves. The default is 0.
+        kind : str, optional
+            "data" for level 0, "min" or "max" for the other levels. The default is "data".
+
+        Returns
+        -------
+        values : Array
+            Array containing the values from start up to stop.
+
+        """
+        start=max(start, 0)
+        stop=min(stop, int(self.levelsizes[level]))
+        if stop<=start:
+            return np.empty(0, dtype=self.dtype)
+        chunks=[self._chunk(level, kind, channel, kk) for kk in range(start//self.chunksize, (stop-1)//self.chunksize+1)]
+        first=start//self.chunksize*self.chunksize
+        return np.concatenate(chunks)[start-first:stop-first]
+
+    def envelope(self, channel, start=0, stop=None, npoints=2000):
+        """
+        Method to get the minimum and maximum values of a channel, using the lowest level that has at most npoints values in the range.
+
+        Parameters
+        ----------
+        channel : int
+            Index of the channel.
+        start : int, optional
+            Index of the first sample. The default is 0.
+        stop : int, optional
+            Index after the last sample. The default is None, for the end of the recording.
+        npoints : int, optional
+            Maximum number of values to return. The default is 2000.
+
+        Returns
+        -------
+        positions : Array of float64
+            Sample index at the center of every value.
+        minval : Array
+            Minimum value per position.
+        maxval : Array
+            Maximum value per position.
+
+        """
+        start=max(int(start), 0)
+        stop=self.shape[1] if stop is None else min(int(stop), self.shape[1])
+        level=0
+        while level<len(self.levelsizes)-1 and (stop-start)/self.factor**level>npoints:
+            level+=1
+        if level==0:
+            values=self.read(channel, start, stop)
+            return np.arange(start, stop, dtype=np.float64), values, values
+        step=self.factor**level
+        first, last=start//step, -(-stop//step)
+        positions=np.arange(first, last)*step+(step-1)/2
+        return positions, self.read(channel, first, last, level, "min"), self.read(channel, first, last, level, "max")
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key=(key,)
+        channelkey, samplekey=(key+(slice(None),))[:2]
+        nframes=self.shape[1]
+        if isinstance(samplekey, slice):
+            start, stop, step=samplekey.indices(nframes)
+            if step>0:
+                values=lambda ch: self.read(ch, start, stop)[::step]
+            else:
+                values=lambda ch: self.read(ch, 0, nframes)[samplekey]
+        else:
+            samples=np.asarray(samplekey)
+            if samples.dtype==bool:
+                samples=np.flatnonzero(samples)
+            if np.any((samples>=nframes)|(samples<-nframes)):
+                raise IndexError(f"index out of range for recording with {nframes} samples")
+            samples=np.where(samples<0, samples+nframes, samples)
+            first=int(np.min(samples)) if samples.size else 0
+            last=int(np.max(samples))+1 if samples.size else 0
+            values=lambda ch: self.read(ch, first, last)[samples-first]
+        channels=np.arange(self.shape[0])[channelkey]
+        if np.ndim(channels)==0:
+            return values(int(channels))
+        return np.array([values(int(ch)) for ch in channels])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for channel in range(self.shape[0]):
+            yield self[channel]
+
+    def __array__(self, dtype=None, copy=None):
+        data=self[:, :]
+        if dtype is not None:
+            data=data.astype(dtype)
+        return data
+
+    def __getstate__(self):
+        #The opened file can not be pickled, it is opened again from the path
+        return {"file": self.file, "cachesize": self.cachesize}
+
+    def __setstate__(self, state):
+        self.__init__(state["file"], state["cachesize"])
+
+    def __deepcopy__(self, memo):
+        #A deep copy is an independent array with the same values
+        return np.array(self)
+
+    def __repr__(self):
+        return f"ChunkedRecording({self.file!r}, shape={self.shape}, dtype={self.dtype})"
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import numpy as np
+from modules.analysis.SpikeTable import SpikeTable
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa=None
+
+#Columns of the exported spike table, in order
+COLUMNS=("channel", "cluster", "threshold", "sample", "time", "amplitude")
+
+def SpikeColumns(clusters, channels, framerate):
+    """
+    Function to convert the spike table to one long-format table, with one row per spike.
+
+    Parameters
+    ----------
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable. NaN padded clusters as made before the table was added are converted.
+    channels : list
+        List containing the available channels.
+    framerate : int
+        Sampling rate of the data.
+
+    Returns
+    -------
+    columns : dict
+        Dictionary with the column names as keys, and arrays of equal length as values.
+        The columns are the channel name, the cluster index, the cluster threshold, the sample index, the time and the amplitude of every spike.
+
+    """
+    table=SpikeTable.fromclusters(clusters, framerate)
+    names=np.array([str(channel) for channel in channels])
+    return {"channel": names[table.channel] if len(table) else np.empty(0, dtype=str),
+            "cluster": table.cluster,
+            "threshold": table.thresholds[table.channel, table.cluster] if len(table) else np.empty(0),
+            "sample": table.sample,
+            "time": table.time,
+            "amplitude": table.amplitude}
+
+def _digits(values, width):
+    """Function to get the ASCII digits of non-negative integers as a uint8 array with shape (len(values), width), with the leading zeros set to 0 bytes."""
+    digits=np.empty((width, len(values)), dtype=np.uint8)
+    remainder=values
+    for ii in range(width-1, -1, -1):
+        remainder, digits[ii]=np.divmod(remainder, 10)
+    digits+=48
+    #The last digit is kept, so 0 is written as 0
+    for ii in range(width-1):
+        digits[ii][values<10**(width-1-ii)]=0
+    return digits.T
+
+def _fraction(values, decimals):
+    """Function to get the ASCII digits after the decimal point as a uint8 array with shape (len(values), decimals), with the trailing zeros except the first decimal set to 0 bytes."""
+    digits=np.empty((decimals, len(values)), dtype=np.uint8)
+    remainder=values
+    for ii in range(decimals-1, -1, -1):
+        remainder, digits[ii]=np.divmod(remainder, 10)
+    digits+=48
+    trailing=np.ones(len(values), dtype=bool)
+    for ii in range(decimals-1, 0, -1):
+        trailing&=digits[ii]==48
+        digits[ii][trailing]=0
+    return digits.T
+
+def _sign(negative):
+    """Function to get a uint8 column with - for the negative values, and 0 bytes otherwise."""
+    return np.where(negative, 45, 0).astype(np.uint8)[:, None]
+
+def _textbytes(values):
+    """Function to get strings as a uint8 array with one row per string, padded with 0 bytes."""
+    values=np.asarray(values, dtype="S")
+    return values.view(np.uint8).reshape(len(values), values.dtype.itemsize)
+
+def _floatbytes(values, maxdecimals=6):
+    """
+    Function to format floats as a uint8 array with one row per value.
+    Values that are stored exactly with at most maxdecimals decimals, such as times and thresholds, are formatted with integer arithmetic.
+    Other values are formatted with repr, which is the slowest part of writing a .csv file.
+    Values between 0 and 1e-4 are also formatted with repr, which writes them in scientific notation, so the output is the same as with str.
+    """
+    if len(values) and np.all(np.isfinite(values)) and np.all(np.abs(values)<2**53/10**maxdecimals):
+        for decimals in range(1, maxdecimals+1):
+            scaled=np.rint(values*10.0**decimals)
+            if np.array_equal(scaled/10.0**decimals, values):
+                whole, fraction=np.divmod(np.abs(scaled).astype(np.int64), 10**decimals)
+                point=np.full((len(values), 1), 46, dtype=np.uint8)
+                fixed=np.hstack((_sign(np.signbit(values)), _digits(whole, len(str(whole.max()))), point, _fraction(fraction, decimals)))
+                small=(values!=0)&(np.abs(values)<1e-4)
+                if not np.any(small):
+                    return fixed
+                fixed[small]=0
+                scientific=_textbytes(list(map(repr, values[small].tolist())))
+                rows=np.zeros((len(values), scientific.shape[1]), dtype=np.uint8)
+                rows[small]=scientific
+                return np.hstack((fixed, rows))
+    return _textbytes(list(map(repr, values.tolist())))
+
+def _columnbytes(values):
+    """Function to format a column as a uint8 array with one row per value, padded with 0 bytes. Values are written as by str."""
+    values=np.asarray(values)
+    if values.dtype.kind=="b":
+        return _textbytes(np.where(values, b"True", b"False"))
+    if values.dtype.kind in "iu":
+        magnitude=np.abs(values.astype(np.int64))
+        return np.hstack((_sign(values<0), _digits(magnitude, len(str(magnitude.max())) if len(values) else 1)))
+    if values.dtype.kind=="f":
+        #float32 values are written as the float64 value they are converted to, as by str
+        return _floatbytes(values.astype(np.float64, copy=False))
+    values=values.astype(str)
+    codes=values.view(np.uint32).reshape(len(values), values.dtype.itemsize//4)
+    if np.all(codes<128):
+        return codes.astype(np.uint8)
+    return _textbytes(np.char.encode(values, "utf-8"))
+
+def WriteCSV(file, columns, info, chunksize=100000):
+    """
+    Function to write a spike table to a .csv file.
+    The file information is written first, as lines starting with #, followed by the header and one line per spike.
+    Every column of a chunk of lines is formatted at once, as a uint8 array of ASCII characters padded with 0 bytes.
+    The columns are placed next to each other with the separators, and the chunk is written in one call after removing the 0 bytes.
+    For 10^6 spikes this takes about 0.6 s if all floats have at most 6 decimals, as times and thresholds do, and about 2 s for filtered amplitudes, half of which is formatting the amplitudes with repr.
+    WriteColumns and WriteArrow are the fast formats for large exports.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file to save to.
+    columns : dict
+        Dictionary with the column names as keys, and arrays of equal length as values, see SpikeColumns.
+    info : list
+        List containing the file information, such as the datatype, framerate, identifier and history.
+    chunksize : int, optional
+        Number of lines that are formatted at once. The default is 100000.
+
+    """
+    keys=list(columns.keys())
+    nrows=len(columns[keys[0]]) if keys else 0
+    with open(file, "wb") as csvfile:
+        csvfile.write("".join(f"# {line}\n" for line in info).encode("utf-8"))
+        csvfile.write((",".join(keys)+"\n").encode("utf-8"))
+        for start in range(0, nrows, chunksize):
+            parts=[]
+            for ii, key in enumerate(keys):
+                parts.append(_columnbytes(columns[key][start:start+chunksize]))
+                parts.append(np.full((len(parts[-1]), 1), 44 if ii<len(keys)-1 else 10, dtype=np.uint8))
+            lines=np.hstack(parts)
+            csvfile.write(lines[lines!=0].tobytes())
+
+def WriteColumns(folder, columns, info):
+    """
+    Function to write a spike table as a folder with one .npy file per column.
+    The file information is stored in Info.npy. Every column can be loaded on its own, memory-mapped with np.load(file, mmap_mode="r").
+
+    Parameters
+    ----------
+    folder : String
+        Path of the folder to save to, it is created if it does not exist.
+    columns : dict
+        Dictionary with the column names as keys, and arrays of equal length as values, see SpikeColumns.
+    info : list
+        List containing the file information, such as the datatype, framerate, identifier and history.
+
+    """
+    os.makedirs(folder, exist_ok=True)
+    for key, values in columns.items():
+        np.save(os.path.join(folder, f"{key}.npy"), values, allow_pickle=False)
+    np.save(os.path.join(folder, "Info.npy"), np.array([str(line) for line in info], dtype=str), allow_pickle=False)
+
+def WriteArrow(file, columns, info):
+    """
+    Function to write a spike table to an Arrow IPC file, requires pyarrow.
+    The file information is stored in the metadata of the schema, with the line numbers as keys.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file to save to.
+    columns : dict
+        Dictionary with the column names as keys, and arrays of equal length as values, see SpikeColumns.
+    info : list
+        List containing the file information, such as the datatype, framerate, identifier and history.
+
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required to export to an Arrow file.")
+    table=pa.table({key: pa.array(values) for key, values in columns.items()})
+    table=table.replace_schema_metadata({str(ii): str(line) for ii, line in enumerate(info)})
+    with pa.OSFile(file, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def ExportSpikes(file, clusters, channels, framerate, info, fileformat=None):
+    """
+    Function to export the spikes of all clusters as one long-format table.
+    The npy and arrow formats store the columns in binary and are the fast formats for many spikes, csv formats every value as text and is several times slower, see WriteCSV.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file, or of the folder for the npy format, to save to.
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable.
+    channels : list
+        List containing the available channels.
+    framerate : int
+        Sampling rate of the data.
+    info : list
+        List containing the file information, such as the datatype, framerate, identifier and history.
+    fileformat : str, optional
+        "csv", "npy" for a folder with a .npy file per column, or "arrow" for an Arrow IPC file.
+        The default is None, to choose by the extension of file: .csv, .arrow or .feather, and npy otherwise.
+
+    Returns
+    -------
+    nspikes : int
+        Number of exported spikes.
+
+    """
+    if fileformat is None:
+        extension=os.path.splitext(file)[1].lower()
+        fileformat={".csv": "csv", ".arrow": "arrow", ".feather": "arrow"}.get(extension, "npy")
+    columns=SpikeColumns(clusters, channels, framerate)
+    if fileformat=="csv":
+        WriteCSV(file, columns, info)
+    elif fileformat=="arrow":
+        WriteArrow(file, columns, info)
+    elif fileformat=="npy":
+        WriteColumns(file, columns, info)
+    else:
+        raise ValueError(f"Unknown export format {fileformat}, use csv, npy or arrow.")
+    return len(columns["sample"])
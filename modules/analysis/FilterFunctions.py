@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import tempfile
+import numpy as np
+from fractions import Fraction
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import butter, iirnotch, tf2sos, sosfilt, sosfilt_zi, sosfiltfilt, resample_poly
+
+
+@lru_cache(maxsize=256)
+def _designfilter(filtertype, order, cutoffs, framerate, quality):
+    """Function to design a filter, results are cached by the arguments."""
+    if filtertype=="notch":
+        sos=tf2sos(*iirnotch(cutoffs[0], quality, framerate))
+    else:
+        sos=butter(order, cutoffs if len(cutoffs)>1 else cutoffs[0], btype=filtertype, output="sos", fs=framerate)
+    #The cached array is shared, so it should not be changed
+    sos.setflags(write=False)
+    return sos
+
+def DesignFilter(filtertype, order, cutoffs, framerate, quality=30):
+    """
+    Function to get the second-order sections of a filter.
+    Designs are cached, so repeated previews and batch runs with the same settings reuse the design.
+
+    Parameters
+    ----------
+    filtertype : str
+        "band" for a bandpass filter, "high" for a highpass filter, "low" for a lowpass filter, or "notch" for a notch filter.
+    order : int
+        Order of the filter. Not used for the notch filter, which is always of order 2.
+    cutoffs : float or list
+        Cut-off frequency, or first the lower, then the upper bound values of the frequencies to keep for a bandpass filter.
+    framerate : int
+        Framerate in frames per second.
+    quality : int, optional
+        Quality of the notch filter. The default is 30.
+
+    Returns
+    -------
+    sos : Array
+        Array of second-order sections, with a row per section.
+
+    """
+    cutoffs=tuple(float(cutoff) for cutoff in np.atleast_1d(cutoffs))
+    #Copy the cached design, scipy needs a writeable array
+    return _designfilter(filtertype, int(order), cutoffs, float(framerate), float(quality)).copy()
+
+def _padlen(sos):
+    """Function to get the number of samples sosfiltfilt pads on both sides by default."""
+    ntaps=2*len(sos)+1-min(np.sum(sos[:, 2]==0), np.sum(sos[:, 5]==0))
+    return 3*ntaps
+
+def blocksosfiltfilt(sos, data, channel, out, blocksize=1000000):
+    """
+    Function to apply a zero-phase filter of second-order sections to one channel in blocks, with the same result as sosfiltfilt.
+    The forward pass goes over the blocks from start to end and the backward pass from end to start, carrying the filter state from block to block.
+    The result of the forward pass is kept in a temporary file, so only a few blocks are held in memory, also for recordings larger than the memory.
+
+    Parameters
+    ----------
+    sos : Array
+        Second-order sections of the filter, see DesignFilter.
+    data : Array
+        Array containing y-values per channel, can be memory-mapped or a ChunkedRecording.
+    channel : int
+        Index of the channel to filter.
+    out : Array
+        Array to write the filtered data to, can be memory-mapped.
+    blocksize : int, optional
+        Number of samples per block. The default is 1000000.
+
+    """
+    nframes=data.shape[1]
+    padlen=_padlen(sos)
+    if nframes<=padlen:
+        raise ValueError(f"The data has to be longer than the padding of {padlen} samples.")
+    zi=sosfilt_zi(sos)
+    #Odd extensions of the start and end of the data, as sosfiltfilt pads the data
+    head=np.asarray(data[channel, :padlen+1], dtype=np.float64)
+    tail=np.asarray(data[channel, nframes-padlen-1:], dtype=np.float64)
+    left=2*head[0]-head[padlen:0:-1]
+    right=2*tail[-1]-tail[-2::-1]
+    with tempfile.TemporaryFile() as tmpfile:
+        forward=np.memmap(tmpfile, dtype=np.float64, mode="w+", shape=(nframes+2*padlen,))
+        #Forward pass, from start to end
+        forward[:padlen], state=sosfilt(sos, left, zi=zi*left[0])
+        for start in range(0, nframes, blocksize):
+            stop=min(start+blocksize, nframes)
+            forward[padlen+start:padlen+stop], state=sosfilt(sos, np.asarray(data[channel, start:stop], dtype=np.float64), zi=state)
+        forward[padlen+nframes:], state=sosfilt(sos, right, zi=state)
+        #Backward pass, from end to start, the padding is not written to the output
+        state=zi*forward[-1]
+        for stop in range(nframes+2*padlen, 0, -blocksize):
+            start=max(stop-blocksize, 0)
+            block, state=sosfilt(sos, forward[start:stop][::-1], zi=state)
+            first, last=max(start, padlen), min(stop, padlen+nframes)
+            if first<last:
+                out[channel, first-padlen:last-padlen]=block[::-1][first-start:last-start]
+        del forward
+
+def _nframes(data):
+    """Function to get the number of samples per channel, from the shape of an array or memory-mapped recording without reading it, or from the first channel of a list."""
+    return data.shape[-1] if hasattr(data, "shape") else len(data[0])
+
+def sosfilter(data, sos, dtype=np.float64, out=None, workers=None, blocksize=None):
+    """
+    Function to apply a zero-phase filter of second-order sections to every channel, one channel at a time.
+    With workers, channels are filtered in parallel threads, the filter releases the GIL so this scales with the number of cores.
+    With blocksize, every channel is filtered in blocks with blocksosfiltfilt, so the data and out can be memory-mapped files larger than the memory.
+    The filter is calculated in float64, only the output is stored in dtype, so at most one channel per worker is held in float64.
+    With dtype np.float32 the filtered values differ from float64 by at most about 1e-6 times the largest absolute value of the channel.
+
+    Parameters
+    ----------
+    data : list
+        List containing the data per channel.
+    sos : Array
+        Second-order sections of the filter, see DesignFilter.
+    dtype : dtype, optional
+        Data type of the filtered data, np.float64 or np.float32. Not used if out is given. The default is np.float64.
+    out : Array, optional
+        Array to write the filtered data to, with the same shape as data. The default is None, for a new array.
+    workers : int, optional
+        Number of threads to filter channels in parallel. The default is None, to filter the channels one after the other.
+    blocksize : int, optional
+        Number of samples per block. The default is None, to filter every channel as a whole.
+
+    Returns
+    -------
+    filtdata : Array
+        Array containing the filtered data per channel.
+
+    """
+    filtdata=np.empty((len(data), _nframes(data)), dtype=dtype) if out is None else out
+    if blocksize is not None and not hasattr(data, "shape"):
+        data=np.asarray(data)
+    def filterchannel(ii):
+        if blocksize is None:
+            filtdata[ii]=sosfiltfilt(sos, np.asarray(data[ii], dtype=np.float64), axis=-1)
+        else:
+            blocksosfiltfilt(sos, data, ii, filtdata, blocksize)
+    if workers is None or workers<=1 or len(filtdata)<=1:
+        [filterchannel(ii) for ii in range(len(filtdata))]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(filtdata))) as pool:
+            list(pool.map(filterchannel, range(len(filtdata))))
+    return filtdata
+
+def resample(data, framerate, newframerate, dtype=np.float64, workers=None):
+    """
+    Function to resample every channel to a new framerate with polyphase filtering, one channel at a time.
+    The ratio of the framerates is used as a fraction up/down, the data is upsampled by up, filtered with an anti-aliasing FIR filter and downsampled by down in one step, without calculating the samples that are removed.
+    NaN values, such as time outside the data selection, are set to 0 for the filter. Resampled values of which the nearest original sample is NaN are set to NaN again.
+
+    Parameters
+    ----------
+    data : list
+        List containing the data per channel.
+    framerate : int
+        Sampling rate of the data.
+    newframerate : int
+        Sampling rate after resampling, frequencies above half of this are removed.
+    dtype : dtype, optional
+        Data type of the resampled data, np.float64 or np.float32. The default is np.float64.
+    workers : int, optional
+        Number of threads to resample channels in parallel. The default is None, to resample the channels one after the other.
+
+    Returns
+    -------
+    resampled : Array
+        Array containing the resampled data per channel.
+    newframerate : int or float
+        Sampling rate of the resampled data, equal to newframerate when both framerates are integers.
+
+    """
+    ratio=Fraction(newframerate).limit_denominator(10**6)/Fraction(framerate).limit_denominator(10**6)
+    up, down=ratio.numerator, ratio.denominator
+    nframes=_nframes(data)
+    resampled=np.empty((len(data), -(-nframes*up//down)), dtype=dtype)
+    #Original sample nearest to every resampled sample
+    nearest=np.minimum(np.rint(np.arange(resampled.shape[1])*down/up).astype(np.int64), nframes-1)
+    def resamplechannel(ii):
+        channel=np.asarray(data[ii], dtype=np.float64)
+        missing=np.isnan(channel)
+        if missing.any():
+            channel=np.where(missing, 0.0, channel)
+        resampled[ii]=resample_poly(channel, up, down)
+        if missing.any():
+            resampled[ii][missing[nearest]]=np.nan
+    if workers is None or workers<=1 or len(resampled)<=1:
+        [resamplechannel(ii) for ii in range(len(resampled))]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(resampled))) as pool:
+            list(pool.map(resamplechannel, range(len(resampled))))
+    newframerate=framerate*up/down
+    if newframerate==int(newframerate):
+        newframerate=int(newframerate)
+    return resampled, newframerate
+
+
+class FilterChain:
+    """
+    Chain of filters that is applied as one filter.
+    The second-order sections of all filters are cascaded, so the data is filtered in a single zero-phase pass into one output array.
+    Away from the edges the result is the same as applying the filters one after the other.
+    """
+    def __init__(self, framerate):
+        """
+        Parameters
+        ----------
+        framerate : int
+            Framerate in frames per second.
+
+        """
+        self.framerate=framerate
+        #List of [description, sos] per filter, the description is as written to the history
+        self.stages=[]
+
+    def notch(self, frequency, quality=30):
+        """Method to add a 2nd order notch filter at frequency. Returns the chain."""
+        self.stages.append([f'Notch filter: {frequency}; quality: {quality}; order: 2', DesignFilter("notch", 2, frequency, self.framerate, quality)])
+        return self
+
+    def harmonics(self, frequency, harmonics, quality=30):
+        """
+        Method to add a bank of 2nd order notch filters at frequency and its harmonics, which are filtered in the same pass. Returns the chain.
+        Harmonics at or above the Nyquist frequency are left out. Every notch has the same quality, so the notches get wider for higher harmonics.
+        """
+        frequencies=[frequency*(ii+1) for ii in range(harmonics+1) if frequency*(ii+1)<self.framerate/2]
+        sos=np.vstack([DesignFilter("notch", 2, freq, self.framerate, quality) for freq in frequencies])
+        self.stages.append([f'Harmonic notch filter: {frequency}; harmonics: {len(frequencies)-1}; quality: {quality}; order: 2', sos])
+        return self
+
+    def bandpass(self, frequencies, order=2):
+        """Method to add a bandpass filter, frequencies contains first the lower, then the upper bound values of the frequencies to keep. Returns the chain."""
+        self.stages.append([f'Bandpass filter: {frequencies[0]}, {frequencies[1]}; order: {order}', DesignFilter("band", order, frequencies, self.framerate)])
+        return self
+
+    def passfilter(self, frequency, highlow, order=2):
+        """Method to add a highpass filter if highlow is "high", or a lowpass filter if highlow is "low". Returns the chain."""
+        self.stages.append([f'{highlow.capitalize()}pass filter: {frequency}; order: {order}', DesignFilter(highlow, order, frequency, self.framerate)])
+        return self
+
+    @property
+    def sos(self):
+        """Second-order sections of all filters in the chain, cascaded."""
+        if not self.stages:
+            return np.empty((0, 6))
+        return np.vstack([sos for _, sos in self.stages])
+
+    def padding(self, tolerance=1e-6):
+        """
+        Method to get the number of samples after which the response of the chain to a step has decayed to tolerance.
+        It is calculated from the pole with the largest radius, as the response decays with the radius to the power of the number of samples.
+
+        Parameters
+        ----------
+        tolerance : float, optional
+            Fraction of the response that is left after the padding. The default is 1e-6.
+
+        Returns
+        -------
+        padding : int
+            Number of samples.
+
+        """
+        if not self.stages:
+            return 0
+        radius=max(np.max(np.abs(np.roots(section[3:]))) for section in self.sos)
+        if radius>=1:
+            raise ValueError("The filter chain is unstable, its response does not decay.")
+        return int(np.ceil(np.log(tolerance)/np.log(radius)))+_padlen(self.sos) if radius>0 else _padlen(self.sos)
+
+    def applywindow(self, data, start, stop, dtype=np.float64, workers=None, tolerance=1e-6):
+        """
+        Method to apply the chain to a time window of multichannel data, for a quick preview.
+        Only the window and padding around it are filtered, so the result differs from filtering all data by at most about tolerance times the largest absolute value of the data.
+
+        Parameters
+        ----------
+        data : Array
+            Array containing y-values per channel.
+        start : int
+            Index of the first sample of the window.
+        stop : int
+            Index after the last sample of the window.
+        dtype : dtype, optional
+            Data type of the filtered data. The default is np.float64.
+        workers : int, optional
+            Number of threads to filter channels in parallel, see sosfilter. The default is None.
+        tolerance : float, optional
+            Tolerance used to calculate the padding, see padding. The default is 1e-6.
+
+        Returns
+        -------
+        filtdata : Array
+            Array containing the filtered data per channel from start up to stop.
+
+        """
+        padding=self.padding(tolerance)
+        first, last=max(start-padding, 0), min(stop+padding, np.shape(data)[1])
+        window=data[:, first:last]
+        #The padding of sosfiltfilt needs more samples than a very short recording has
+        if self.stages and last-first<=_padlen(self.sos):
+            return np.array(window[:, start-first:stop-first], dtype=dtype)
+        return self.apply(window, dtype, workers=workers)[:, start-first:stop-first]
+
+    def descriptions(self):
+        """Method to get the descriptions of the filters in the chain, to add to the history."""
+        return [description for description, _ in self.stages]
+
+    def apply(self, data, dtype=np.float64, out=None, workers=None, blocksize=None):
+        """
+        Method to apply the chain to multichannel data.
+
+        Parameters
+        ----------
+        data : list
+            List containing the data per channel.
+        dtype : dtype, optional
+            Data type of the filtered data. Not used if out is given. The default is np.float64.
+        out : Array, optional
+            Array to write the filtered data to, with the same shape as data. The default is None, for a new array.
+        workers : int, optional
+            Number of threads to filter channels in parallel, see sosfilter. The default is None.
+        blocksize : int, optional
+            Number of samples per block, to filter in blocks, see sosfilter. The default is None.
+
+        Returns
+        -------
+        filtdata : Array
+            Array containing the filtered data per channel. A copy of the data in its own data type if the chain is empty.
+
+        """
+        if not self.stages:
+            if out is None:
+                return np.array(data)
+            out[:]=data
+            return out
+        return sosfilter(data, self.sos, dtype, out, workers, blocksize)
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __repr__(self):
+        return f"FilterChain({self.framerate}, {self.descriptions()})"
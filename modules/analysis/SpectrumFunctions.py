@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import scipy as sp
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def Spectrum(data, framerate, segment=8192, overlap=0.5, workers=None, batchsize=256):
+    """
+    Function to calculate the power spectral density per channel with Welch's method.
+    The data is split into overlapping segments, every segment has its mean removed, is multiplied by a Hann window, and is transformed with a real FFT.
+    The FFT length is the segment length padded to a fast length, and the power of all segments is averaged.
+    Segments that contain NaN values, such as time outside the data selection, are skipped.
+    The data is read a batch of segments at a time, so it can be memory-mapped.
+
+    Parameters
+    ----------
+    data : Array
+        Array containing y-values per channel.
+    framerate : int
+        Sampling rate of the data.
+    segment : int, optional
+        Number of samples per segment, longer segments give a finer frequency resolution. Shortened to the length of the data if it is shorter. The default is 8192.
+    overlap : float, optional
+        Proportion of a segment that overlaps with the next segment. The default is 0.5.
+    workers : int, optional
+        Number of threads for the FFT. The default is None.
+    batchsize : int, optional
+        Number of segments that are transformed at once. The default is 256.
+
+    Returns
+    -------
+    freqs : Array of float64
+        Frequency of every value of the spectrum, in Hz.
+    psd : Array of float64
+        Power spectral density per channel. NaN for a channel without any segment without NaN values.
+
+    """
+    if not hasattr(data, "shape"):
+        data=np.asarray(data)
+    nchannels, nframes=data.shape[0], data.shape[-1]
+    segment=max(min(int(segment), nframes), 1)
+    step=max(int(segment*(1-overlap)), 1)
+    nfft=sp.fft.next_fast_len(segment, real=True)
+    window=sp.signal.get_window("hann", segment)
+    #Scale to a one-sided density, the zero and Nyquist frequencies only occur once
+    scale=np.full(nfft//2+1, 2/(framerate*np.sum(window**2)))
+    scale[0]/=2
+    if nfft%2==0:
+        scale[-1]/=2
+    starts=np.arange(0, nframes-segment+1, step)
+    psd=np.zeros((nchannels, nfft//2+1))
+    for ii in range(nchannels):
+        count=0
+        for first in range(0, len(starts), batchsize):
+            batch=starts[first:first+batchsize]
+            values=np.asarray(data[ii, batch[0]:batch[-1]+segment], dtype=np.float64)
+            segments=sliding_window_view(values, segment)[::step]
+            segments=segments[~np.isnan(segments).any(axis=1)]
+            if not len(segments):
+                continue
+            segments=(segments-segments.mean(axis=1, keepdims=True))*window
+            psd[ii]+=np.sum(np.abs(sp.fft.rfft(segments, n=nfft, axis=-1, workers=workers))**2, axis=0)
+            count+=len(segments)
+        psd[ii]=psd[ii]*scale/count if count else np.nan
+    return sp.fft.rfftfreq(nfft, 1/framerate), psd
+
+def LineNoise(data, framerate, frequencies=(50, 60), harmonics=10, nsegments=16, duration=1.0, threshold=10.0):
+    """
+    Function to estimate the power line frequency and the number of its harmonics per channel from a sample of the data.
+    Instead of the whole recording, nsegments segments spread evenly over the recording are read. All segments of all channels are windowed with a Hann window and transformed with one real FFT, and their power is averaged.
+    The strength of a line frequency is the power at the frequency divided by the median power of the surrounding frequencies, from 2 to 10 Hz away.
+
+    Parameters
+    ----------
+    data : Array
+        Array containing y-values per channel.
+    framerate : int
+        Sampling rate of the data.
+    frequencies : tuple, optional
+        Line frequencies to test, in Hz. The default is (50, 60).
+    harmonics : int, optional
+        Largest number of harmonics to test, above the line frequency. Harmonics at or above the Nyquist frequency are not tested. The default is 10.
+    nsegments : int, optional
+        Number of segments that are read from the data. The default is 16.
+    duration : float, optional
+        Duration of a segment in seconds, which sets the frequency resolution. Shortened to the length of the data if it is shorter. The default is 1.0.
+    threshold : float, optional
+        Strength above which a line frequency or harmonic counts as present. The default is 10.0.
+
+    Returns
+    -------
+    frequency : Array
+        Line frequency with the strongest fundamental per channel, 0 for a channel without line noise above threshold.
+    nharmonics : Array of int
+        Number of harmonics per channel, the highest present multiple of the line frequency minus 1, also if lower harmonics are not present.
+    strength : Array of float64
+        Strength per channel, line frequency and multiple, with shape (channels, len(frequencies), harmonics+1). NaN for multiples at or above the Nyquist frequency.
+
+    """
+    if not hasattr(data, "shape"):
+        data=np.asarray(data)
+    nchannels, nframes=data.shape[0], data.shape[-1]
+    segment=max(min(int(duration*framerate), nframes), 1)
+    starts=np.unique(np.linspace(0, nframes-segment, nsegments).astype(np.int64))
+    #Read all segments at once, shape (channels, segments, samples)
+    segments=np.stack([np.asarray(data[:, start:start+segment], dtype=np.float64) for start in starts], axis=1)
+    #Mean over the values that are not NaN, segments outside the data selection are all NaN
+    counts=np.maximum(np.sum(~np.isnan(segments), axis=-1, keepdims=True), 1)
+    segments=np.nan_to_num(segments-np.nansum(segments, axis=-1, keepdims=True)/counts)
+    window=sp.signal.get_window("hann", segment)
+    power=np.mean(np.abs(sp.fft.rfft(segments*window, axis=-1))**2, axis=1)
+    freqs=sp.fft.rfftfreq(segment, 1/framerate)
+    #Frequency of every line frequency and multiple, shape (frequencies, harmonics+1)
+    multiples=np.outer(frequencies, np.arange(1, harmonics+2)).astype(np.float64)
+    valid=multiples<framerate/2
+    bins=np.searchsorted(freqs, multiples).clip(0, len(freqs)-1)
+    offset=np.concatenate([np.arange(-10, -1), np.arange(2, 11)])*segment/framerate
+    neighbours=(bins[..., None]+np.rint(offset).astype(np.int64)).clip(0, len(freqs)-1)
+    #Peak power within one bin of every multiple, against the median of its neighbourhood
+    peak=np.max(np.stack([power[:, (bins+shift).clip(0, len(freqs)-1)] for shift in (-1, 0, 1)]), axis=0)
+    strength=peak/np.maximum(np.median(power[:, neighbours], axis=-1), np.finfo(np.float64).tiny)
+    strength[:, ~valid]=np.nan
+    fundamental=np.nan_to_num(strength[:, :, 0])
+    best=np.argmax(fundamental, axis=1)
+    present=fundamental[np.arange(nchannels), best]>threshold
+    frequency=np.where(present, np.asarray(frequencies)[best], 0)
+    above=np.nan_to_num(strength[np.arange(nchannels), best])>threshold
+    nharmonics=np.where(present, harmonics-np.argmax(above[:, ::-1], axis=1), 0)
+    return frequency, nharmonics, strength
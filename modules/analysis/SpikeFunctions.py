@@ -18,17 +18,30 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import numpy as np
-import scipy as sp
 import os
+import struct
+import zipfile
+import glob
+import tempfile
 import traceback
 from collections import defaultdict
-from scipy.signal import butter, iirnotch, filtfilt
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from modules.analysis.FilterFunctions import DesignFilter, sosfilter
+from modules.analysis.TimeAxis import TimeAxis
+from modules.analysis.WavReader import WavReader
+from modules.analysis.ChunkedRecording import ChunkedRecording, WriteChunked
+from modules.analysis.SpikeTable import SpikeTable
+try:
+    import numba
+except ImportError:
+    numba=None
 
 
-def OpenRecording(folder, filename):
+def OpenRecording(folder, filename, mmap=False):
     """
     Function to load in data and markers.
-    Accepted file extensions are .wav, and .npz.
+    Accepted file extensions are .wav, including RF64 and BW64 files larger than 4 GB, .npz, and .mrz.
 
     Parameters
     ----------
@@ -36,17 +49,19 @@ def OpenRecording(folder, filename):
         String of the folder path from where to load the file.
     filename : String
         String of the filename including extension.
+    mmap : bool, optional
+        If True, the data of .wav files and of .npz files saved with SaveSession is memory-mapped instead of read into memory. Every channel is then a read-only view on the file, so only the parts of the recording that are used get read from disk. The default is False.
 
     Returns
     -------
     data : Array of int64
         Array containing y-values per channel.
-    clusters : list
-        A list containing all peaks above threshold height, timestamps of peaks, heights of peaks, height of spike marker per peak, and the threshold height per threshold per channel.
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable. NaN padded clusters of files saved before the table was added are converted.
     markers : defaultdict
-        Dictionary with marker numbers as keys, and marker time stamps as values.
-    time : Array of float64
-        Array containing x-values per channel. First index is channel, second contains x-values.
+        Dictionary with marker IDs as keys, and marker time stamps as values.
+    time : TimeAxis
+        Time axis of the data, gives the x-values in seconds.
     framerate : int
         Sampling rate of the data.
     datatype : str
@@ -69,7 +84,7 @@ def OpenRecording(folder, filename):
               "Data": [],
               "Markers": defaultdict(list),
               "Clusters": [],
-              "Time": [],
+              "TimeAxis": [],
               "Framerate": 10000,
               "History": [],
               "Identifier": "001",
@@ -77,37 +92,40 @@ def OpenRecording(folder, filename):
               }
     if ".wav" in filename: #SpikeRecorder Data (Backyard Brains, SpikerBox)
         #import .wav file and corresponding marker file
-        rec = sp.io.wavfile.read(file)
+        wav=WavReader(file)
+        try:
+            rec = (wav.framerate, wav.memmap() if mmap else wav.read())
+        except ValueError:
+            #24-bit .wav files can not be memory-mapped, read them into memory instead
+            rec = (wav.framerate, wav.read())
+            mmap=False
         nomarker=False
         try:
-            with open(markerfile, encoding="utf8") as csvfile:
-                markersCSV=np.genfromtxt(csvfile, delimiter=',')
+            markers=MarkerDict(*ReadMarkers(markerfile))
         except FileNotFoundError:
             nomarker=[traceback.format_exc()]
-            markersCSV=[]
+            markers=defaultdict(list)
         #setup data from import .wav file
         framerate = rec[0]
-        if len(rec[1].shape)==1: #when single channel recording
-            data=np.array([rec[1]])
-            ch=1
-        elif rec[1].shape[0]>rec[1].shape[1]: #check if axes need to be swapped
-            data=np.swapaxes(rec[1], 0, 1)
-            ch=rec[1].shape[1]
-        else:
-            data=rec[1]
-            ch=rec[1].shape[0]
+        data, ch=_channelsfirst(rec[1])
+        if mmap:
+            #The swapped axes and added channel axis are views, so the data still points to the file
+            data.setflags(write=False)
         nframes = np.size(data, 1)
-        time = np.array([x/framerate for x in np.arange(nframes)]) # in seconds
-        #setup marker list
-        markers=defaultdict(list)
-        for key in markersCSV:
-            markers[key[0]].append(key[1])
+        time = TimeAxis(framerate, nframes) # in seconds
         datatype=defaults["Datatype"]
-        clusters=defaults["Clusters"]
+        clusters=SpikeTable.empty(framerate)
         history=defaults["History"]
         identifier=defaults["Identifier"]
         channels=np.array([f'Channel {ii+1}' for ii in range(ch)])
-    elif ".npz" in filename[-4:]: #SpikeAnalysis tool saved data
+    elif ".npz" in filename[-4:] and _issession(file): #SpikeAnalysis tool saved data, typed format
+        data, clusters, markers, time, framerate, datatype, history, identifier, channels=LoadSession(file, mmap)
+        nomarker=not markers
+    elif ".mrz" in filename[-4:]: #SpikeAnalysis tool saved data, multi-resolution chunked format
+        data=ChunkedRecording(file)
+        clusters, markers, time, framerate, datatype, history, identifier, channels=_readsession(file, data.npzfile)
+        nomarker=not markers
+    elif ".npz" in filename[-4:]: #SpikeAnalysis tool saved data, files saved before the typed format was added
         npzfile=np.load(file, allow_pickle=True)
         loaddata=[]
         for key in defaults.keys():
@@ -123,10 +141,14 @@ def OpenRecording(folder, filename):
         data=loaddata[1]
         markerstmp=loaddata[2]
         markersdict=dict(enumerate(markerstmp.flatten(),1))[1]
-        markers=defaultdict(list,markersdict)
-        clusters=loaddata[3]
-        time=loaddata[4]
+        markers=defaultdict(list,{_markerkey(key): item for key, item in markersdict.items()})
         framerate=loaddata[5]
+        clusters=SpikeTable.fromclusters(loaddata[3], framerate)
+        if len(loaddata[4]):
+            time=TimeAxis.fromrecord(loaddata[4])
+        else:
+            #Files saved before the time axis was added store every time value, which always started at 0
+            time=TimeAxis(framerate, np.size(data, -1))
         history=loaddata[6]
         identifier=loaddata[7]
         channels=loaddata[8]
@@ -136,7 +158,585 @@ def OpenRecording(folder, filename):
             nomarker=True
     return data, clusters, markers, time, framerate, datatype, history, identifier, channels, nomarker
 
-def bandpassfilter(data, framerate, order, frequencies):
+RECORDINGEXTENSIONS=(".wav", ".npz", ".mrz")
+
+def OpenDirectory(path, workers=None, lazy=False, processes=False, mmap=False):
+    """
+    Function to open all recordings in a directory, or all recordings matching a glob pattern, concurrently.
+    Every recording is opened with OpenRecording, an error in one file does not stop the other files from being opened.
+
+    Parameters
+    ----------
+    path : String
+        Path of a directory, of which all .wav, .npz, and .mrz files are opened, or a glob pattern such as "recordings/*.wav".
+    workers : int, optional
+        Maximum number of files that are opened at the same time. The default is None, for the default of the executor.
+    lazy : bool, optional
+        If True, the files are not opened, instead a handle is returned per file that opens the file with OpenRecording when it is called. The default is False.
+    processes : bool, optional
+        If True, the files are opened in separate processes instead of threads, for recordings that need a lot of decoding. The data is then copied back, so it is not memory-mapped. The default is False.
+    mmap : bool, optional
+        If True, the data is memory-mapped when possible, see OpenRecording. The default is False.
+
+    Returns
+    -------
+    recordings : dict
+        Dictionary with the file paths as keys, in sorted order, and the output of OpenRecording, or a handle if lazy is True, as values.
+    errors : dict
+        Dictionary with the file paths that could not be opened as keys, and the traceback as values.
+
+    """
+    if os.path.isdir(path):
+        files=[os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(RECORDINGEXTENSIONS)]
+    else:
+        files=[file for file in glob.glob(path) if file.lower().endswith(RECORDINGEXTENSIONS)]
+    files=sorted(files)
+    if lazy:
+        return {file: partial(OpenRecording, os.path.dirname(file), os.path.basename(file), mmap) for file in files}, {}
+    recordings={}
+    errors={}
+    executor=ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        futures={file: pool.submit(OpenRecording, os.path.dirname(file), os.path.basename(file), mmap) for file in files}
+        for file, future in futures.items():
+            try:
+                recordings[file]=future.result()
+            except Exception as error:
+                errors[file]="".join(traceback.format_exception(type(error), error, error.__traceback__))
+    return recordings, errors
+
+#Version 3 stores the sample index of every spike and the marker height per channel and cluster, version 2 the time and marker height of every spike
+SESSIONVERSION=3
+
+def _issession(file):
+    """Function to check if a .npz file is saved in the typed session format."""
+    with np.load(file) as npzfile:
+        return "FormatVersion" in npzfile
+
+def _markerkey(markerid):
+    """Function to convert a marker ID from files saved before string marker IDs were used, where numeric IDs were stored as floats."""
+    if isinstance(markerid, (float, np.floating)) and float(markerid).is_integer():
+        return str(int(markerid))
+    return str(markerid)
+
+def ReadMarkers(file):
+    """
+    Function to read a marker file, as made by SpikeRecorder.
+    Every line contains a marker ID and a time stamp in seconds, separated by a comma. Lines starting with # are ignored.
+    Marker IDs can be arbitrary strings, only the last comma of a line separates the ID from the time stamp.
+
+    Parameters
+    ----------
+    file : String
+        Path of the marker file.
+
+    Returns
+    -------
+    markers : Array
+        Structured array with the fields "id" (str) and "time" (float64), one row per marker in the order of the file.
+    index : dict
+        Dictionary with the marker IDs as keys, in order of first appearance, and arrays with the row numbers of that ID in markers as values.
+
+    """
+    with open(file, encoding="utf8") as csvfile:
+        lines=[line for line in csvfile.read().splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    if not lines:
+        return np.empty(0, dtype=[("id", "U1"), ("time", np.float64)]), {}
+    fields=np.char.rpartition(np.array(lines), ",")
+    ids=np.char.strip(fields[:, 0])
+    ids=ids.astype(f"U{max(np.max(np.char.str_len(ids)), 1)}")
+    markers=np.empty(len(ids), dtype=[("id", ids.dtype), ("time", np.float64)])
+    markers["id"]=ids
+    markers["time"]=fields[:, 2].astype(np.float64)
+    #Group the rows per ID, ordering the IDs by their first appearance
+    uniqueids, first, inverse=np.unique(ids, return_index=True, return_inverse=True)
+    rows=np.argsort(inverse, kind="stable")
+    offsets=np.concatenate(([0], np.cumsum(np.bincount(inverse))))
+    index={str(uniqueids[kk]): rows[offsets[kk]:offsets[kk+1]] for kk in np.argsort(first)}
+    return markers, index
+
+def MarkerDict(markers, index):
+    """
+    Function to convert the markers from ReadMarkers to the marker dictionary used by the GUI.
+
+    Parameters
+    ----------
+    markers : Array
+        Structured array with the fields "id" and "time".
+    index : dict
+        Dictionary with the marker IDs as keys, and arrays with the row numbers of that ID in markers as values.
+
+    Returns
+    -------
+    markers : defaultdict
+        Dictionary with marker IDs as keys, and lists of marker time stamps as values.
+
+    """
+    return defaultdict(list, {key: list(markers["time"][rows]) for key, rows in index.items()})
+
+def _sessionarrays(clusters, markers, time, framerate, datatype, history, identifier, channels):
+    """Function to convert everything except the data to the typed arrays of the session format."""
+    #The table already stores the spikes as flat arrays, with offsets per channel and cluster, the time follows from the sample index and the framerate of the table
+    table=SpikeTable.fromclusters(clusters, framerate)
+    return {"FormatVersion": np.array(SESSIONVERSION),
+            "Datatype": np.array(str(datatype)),
+            "Framerate": np.array(framerate),
+            "TimeAxis": time.torecord(),
+            "MarkerIDs": np.array([str(key) for key in markers.keys() for _ in markers[key]], dtype=str),
+            "MarkerTimes": np.array([mark for key in markers.keys() for mark in markers[key]], dtype=np.float64),
+            "History": np.array([str(his) for his in history], dtype=str),
+            "Identifier": np.array(str(identifier)),
+            "Channels": np.array([str(ch) for ch in channels], dtype=str),
+            "ClusterThresholds": table.thresholds,
+            "ClusterMarkerHeights": table.markerheights,
+            "SpikeOffsets": table.offsets,
+            "SpikeFramerate": np.array(table.framerate),
+            "SpikeIndices": table.sample,
+            "SpikeHeights": table.amplitude}
+
+def _readsession(file, npzfile):
+    """Function to convert the typed arrays of the session format back to everything except the data."""
+    version=int(npzfile["FormatVersion"])
+    if version>SESSIONVERSION:
+        raise ValueError(f"{file} is saved with session format version {version}, only up to version {SESSIONVERSION} is supported.")
+    datatype=str(npzfile["Datatype"])
+    framerate=npzfile["Framerate"][()]
+    time=TimeAxis.fromrecord(npzfile["TimeAxis"])
+    history=list(npzfile["History"])
+    identifier=str(npzfile["Identifier"])
+    channels=npzfile["Channels"]
+    markers=defaultdict(list)
+    for key, mark in zip(npzfile["MarkerIDs"], npzfile["MarkerTimes"]):
+        markers[str(key)].append(mark)
+    thresholds=npzfile["ClusterThresholds"]
+    spikeoffsets=npzfile["SpikeOffsets"]
+    counts=np.diff(spikeoffsets)
+    #The channel and cluster of every spike follow from the offsets
+    keys=np.repeat(np.arange(len(counts)), counts)
+    nclusters=max(thresholds.shape[1], 1) if thresholds.ndim==2 else 1
+    spikeframerate=framerate
+    if version>=3:
+        sample=npzfile["SpikeIndices"]
+        markerheights=npzfile["ClusterMarkerHeights"]
+        #The spikes can be sorted at another framerate than the data, if the data was resampled after sorting
+        if "SpikeFramerate" in npzfile:
+            spikeframerate=npzfile["SpikeFramerate"][()]
+    else:
+        #Version 2 stores the time and marker height of every spike, PeakIndices are all peaks found, not only the spikes
+        sample=np.rint(npzfile["SpikeTimes"]*framerate).astype(np.int64)
+        markerheights=np.full(len(counts), np.nan)
+        markerheights[counts>0]=npzfile["SpikeMarkerHeights"][spikeoffsets[:-1][counts>0]]
+    clusters=SpikeTable(sample, keys//nclusters, keys%nclusters, npzfile["SpikeHeights"], thresholds, markerheights.reshape(thresholds.shape), spikeframerate)
+    return clusters, markers, time, framerate, datatype, history, identifier, channels
+
+def SaveSession(file, data, clusters, markers, time, framerate, datatype, history, identifier, channels):
+    """
+    Function to save the data in the typed session format.
+    The session is a .npz file that only contains typed arrays, so it can be opened without pickle.
+    The spike table is stored as flat arrays with offsets per channel and cluster, and the markers as an array of IDs and an array of times.
+    The file is written uncompressed, so the data can be memory-mapped when it is opened.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file to save to. The .npz extension is added if it is missing.
+    data : Array
+        Array containing y-values per channel.
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable. NaN padded clusters as made before the table was added are converted.
+    markers : defaultdict
+        Dictionary with marker IDs as keys, and marker time stamps as values.
+    time : TimeAxis
+        Time axis of the data.
+    framerate : int
+        Sampling rate of the data.
+    datatype : str
+        String denoting the type of the data.
+    history : list
+        List containing all changes made to the original data.
+    identifier : string
+        String denoting the identifier of the data.
+    channels : list
+        List containing the available channels.
+
+    """
+    if not file.endswith(".npz"):
+        file=f"{file}.npz"
+    arrays=_sessionarrays(clusters, markers, time, framerate, datatype, history, identifier, channels)
+    arrays["Data"]=np.asarray(data)
+    #Write to a temporary file first, the data could be memory-mapped from the file that is overwritten
+    with open(f"{file}.tmp", "wb") as tmpfile:
+        np.savez(tmpfile, **arrays)
+    _replace(f"{file}.tmp", file, data)
+
+def SaveChunked(file, data, clusters, markers, time, framerate, datatype, history, identifier, channels):
+    """
+    Function to save the data in the multi-resolution chunked .mrz format, meant for very long recordings.
+    Every channel is stored in compressed chunks together with levels of minimum and maximum values, see ChunkedRecording.
+    Everything except the data is stored as in the typed session format of SaveSession.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file to save to. The .mrz extension is added if it is missing.
+    data : Array
+        Array containing y-values per channel.
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable. NaN padded clusters as made before the table was added are converted.
+    markers : defaultdict
+        Dictionary with marker IDs as keys, and marker time stamps as values.
+    time : TimeAxis
+        Time axis of the data.
+    framerate : int
+        Sampling rate of the data.
+    datatype : str
+        String denoting the type of the data.
+    history : list
+        List containing all changes made to the original data.
+    identifier : string
+        String denoting the identifier of the data.
+    channels : list
+        List containing the available channels.
+
+    """
+    if not file.endswith(".mrz"):
+        file=f"{file}.mrz"
+    arrays=_sessionarrays(clusters, markers, time, framerate, datatype, history, identifier, channels)
+    #Write to a temporary file first, the data could be read from the file that is overwritten
+    WriteChunked(f"{file}.tmp", data, arrays)
+    _replace(f"{file}.tmp", file, data)
+
+def _replace(tmpfile, file, data):
+    """Function to replace file by the saved tmpfile. A ChunkedRecording read from file is closed while it is replaced, and opened again from the new file."""
+    reopen=isinstance(data, ChunkedRecording) and data.npzfile is not None and os.path.abspath(data.file)==os.path.abspath(file)
+    if reopen:
+        data.close()
+    os.replace(tmpfile, file)
+    if reopen:
+        data.open()
+
+def LoadSession(file, mmap=True):
+    """
+    Function to load data saved in the typed session format by SaveSession.
+    Pickle is never used to load the file.
+
+    Parameters
+    ----------
+    file : String
+        Path of the file.
+    mmap : bool, optional
+        If True, the data is memory-mapped, so it is only read from disk when it is used. The default is True.
+
+    Returns
+    -------
+    data : Array
+        Array containing y-values per channel.
+    clusters : SpikeTable
+        Table containing the sorted spikes, see SpikeTable.
+    markers : defaultdict
+        Dictionary with marker IDs as keys, and marker time stamps as values.
+    time : TimeAxis
+        Time axis of the data.
+    framerate : int
+        Sampling rate of the data.
+    datatype : str
+        String denoting the type of the data.
+    history : list
+        List containing all changes made to the original data.
+    identifier : string
+        String denoting the identifier of the data.
+    channels : list
+        List containing the available channels.
+
+    """
+    with np.load(file) as npzfile:
+        clusters, markers, time, framerate, datatype, history, identifier, channels=_readsession(file, npzfile)
+        data=_npzmemmap(file, "Data") if mmap else npzfile["Data"]
+    return data, clusters, markers, time, framerate, datatype, history, identifier, channels
+
+def _channelsfirst(samples):
+    """Function to get a view on the samples with channels as the first axis, and the number of channels."""
+    if len(samples.shape)==1: #when single channel recording
+        return samples[np.newaxis,:], 1
+    elif samples.shape[0]>samples.shape[1]: #check if axes need to be swapped
+        return np.swapaxes(samples, 0, 1), samples.shape[1]
+    return samples, samples.shape[0]
+
+def _npzmemmap(file, key):
+    """
+    Function to memory-map an array from a .npz file.
+    Only arrays that are stored uncompressed and do not contain objects can be memory-mapped, other arrays are read into memory.
+
+    Parameters
+    ----------
+    file : String
+        Path of the .npz file.
+    key : String
+        Name of the array in the .npz file.
+
+    Returns
+    -------
+    array : memmap or Array
+        Read-only memory-map of the array, or the array itself if it could not be memory-mapped.
+
+    """
+    with zipfile.ZipFile(file) as zf:
+        info=zf.getinfo(f"{key}.npy")
+        if info.compress_type==zipfile.ZIP_STORED:
+            with zf.open(info) as member:
+                version=np.lib.format.read_magic(member)
+                if version==(1,0):
+                    shape, fortran, dtype=np.lib.format.read_array_header_1_0(member)
+                elif version==(2,0):
+                    shape, fortran, dtype=np.lib.format.read_array_header_2_0(member)
+                else:
+                    shape, dtype=(), np.dtype(object)
+                headerlength=member.tell()
+            if not dtype.hasobject and np.prod(shape)>0:
+                #The array is stored after the local file header of the zip member, and the .npy header
+                with open(file, "rb") as raw:
+                    raw.seek(info.header_offset)
+                    localheader=struct.unpack("<4s5H3I2H", raw.read(30))
+                offset=info.header_offset+30+localheader[-2]+localheader[-1]+headerlength
+                return np.memmap(file, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran else "C")
+    with np.load(file) as npzfile:
+        return npzfile[key]
+
+def _opensamples(file):
+    """Function to open the samples of a .wav, .npz or .mrz file without reading them, with channels as the first axis. Returns the samples and the framerate."""
+    if file.endswith(".wav"):
+        wav=WavReader(file)
+        try:
+            samples=wav.memmap()
+        except ValueError:
+            samples=wav.read()
+        return _channelsfirst(samples)[0], wav.framerate
+    elif file.endswith(".npz"):
+        with np.load(file) as npzfile:
+            framerate=npzfile["Framerate"][()] if "Framerate" in npzfile else 10000
+        return _npzmemmap(file, "Data"), framerate
+    elif file.endswith(".mrz"):
+        data=ChunkedRecording(file)
+        return data, data.npzfile["Framerate"][()]
+    raise ValueError(f"Unsupported file extension: {file}")
+
+def IterBlocks(data, blocksize, overlap=0):
+    """
+    Generator to iterate over multichannel data in blocks of a fixed size.
+    Every block is copied from the data when it is yielded, so the data can be memory-mapped.
+
+    Parameters
+    ----------
+    data : Array
+        Array containing the y-values per channel.
+    blocksize : int
+        Number of samples per block.
+    overlap : int, optional
+        Number of samples from the neighbouring blocks added to both sides of every block. The default is 0.
+
+    Yields
+    ------
+    start : int
+        Index of the first sample of the block, without the overlap.
+    stop : int
+        Index after the last sample of the block, without the overlap.
+    pre : int
+        Number of overlap samples before start, this is smaller than the overlap at the start of the data.
+    block : Array
+        Array containing the y-values per channel from start-overlap up to stop+overlap, clipped to the size of the data.
+
+    """
+    nframes=np.size(data, -1)
+    for start in range(0, nframes, blocksize):
+        stop=min(start+blocksize, nframes)
+        pre=min(overlap, start)
+        yield start, stop, pre, np.array(data[:, start-pre:min(stop+overlap, nframes)])
+
+def ReadBlocks(folder, filename, blocksize, overlap=0):
+    """
+    Generator to read a recording in blocks of a fixed size, without loading the full recording into memory.
+    Accepted file extensions are .wav, .npz, and .mrz.
+
+    Parameters
+    ----------
+    folder : String
+        String of the folder path from where to load the file.
+    filename : String
+        String of the filename including extension.
+    blocksize : int
+        Number of samples per block.
+    overlap : int, optional
+        Number of samples from the neighbouring blocks added to both sides of every block. The default is 0.
+
+    Yields
+    ------
+    start : int
+        Index of the first sample of the block, without the overlap.
+    stop : int
+        Index after the last sample of the block, without the overlap.
+    pre : int
+        Number of overlap samples before start, this is smaller than the overlap at the start of the data.
+    block : Array
+        Array containing the y-values per channel from start-overlap up to stop+overlap, clipped to the size of the recording.
+
+    """
+    data, _=_opensamples(os.path.join(folder, filename))
+    try:
+        yield from IterBlocks(data, blocksize, overlap)
+    finally:
+        if hasattr(data, "close"):
+            data.close()
+
+def BlockStatistics(blocks):
+    """
+    Function to calculate the statistics per channel from blocks of data.
+    NaN values are ignored.
+
+    Parameters
+    ----------
+    blocks : iterable
+        Blocks as yielded by IterBlocks or ReadBlocks.
+
+    Returns
+    -------
+    mean : Array of float64
+        Mean per channel.
+    std : Array of float64
+        Standard deviation per channel.
+    minval : Array of float64
+        Minimum per channel.
+    maxval : Array of float64
+        Maximum per channel.
+
+    """
+    count=None
+    for start, stop, pre, block in blocks:
+        #Only use the samples of the block itself, not the overlap
+        block=np.asarray(block[:, pre:pre+stop-start], dtype=np.float64)
+        valid=~np.isnan(block)
+        blockcount=np.sum(valid, axis=1)
+        blockmean=np.sum(np.where(valid, block, 0), axis=1)/np.maximum(blockcount, 1)
+        blocksqdev=np.sum(np.where(valid, block-blockmean[:,np.newaxis], 0)**2, axis=1)
+        blockmin=np.fmin.reduce(block, axis=1)
+        blockmax=np.fmax.reduce(block, axis=1)
+        if count is None:
+            count, mean, sqdev, minval, maxval=blockcount, blockmean, blocksqdev, blockmin, blockmax
+            continue
+        #Combine the statistics of the previous blocks with those of the new block
+        total=count+blockcount
+        delta=blockmean-mean
+        mean=mean+delta*blockcount/np.maximum(total, 1)
+        sqdev=sqdev+blocksqdev+delta**2*count*blockcount/np.maximum(total, 1)
+        count=total
+        minval=np.fmin(minval, blockmin)
+        maxval=np.fmax(maxval, blockmax)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean=np.where(count, mean, np.nan)
+        std=np.sqrt(sqdev/count)
+    return mean, std, minval, maxval
+
+def FilterRecording(folder, filename, outfile, chain, blocksize=1000000, dtype=np.float64, workers=None):
+    """
+    Function to filter a recording in blocks and save it in the typed session format, without loading the recording into memory.
+    The result is the same as filtering the recording as a whole, see blocksosfiltfilt.
+
+    Parameters
+    ----------
+    folder : String
+        String of the folder path from where to load the file.
+    filename : String
+        String of the filename including extension.
+    outfile : String
+        Path of the file to save to. The .npz extension is added if it is missing.
+    chain : FilterChain
+        Filters to apply. The descriptions of the filters are added to the history.
+    blocksize : int, optional
+        Number of samples per block. The default is 1000000.
+    dtype : dtype, optional
+        Data type of the filtered data. The default is np.float64.
+    workers : int, optional
+        Number of threads to filter channels in parallel. The default is None.
+
+    Returns
+    -------
+    outfile : String
+        Path of the saved file.
+
+    """
+    data, clusters, markers, time, framerate, datatype, history, identifier, channels, _=OpenRecording(folder, filename, mmap=True)
+    if not outfile.endswith(".npz"):
+        outfile=f"{outfile}.npz"
+    #The filtered data is kept in a temporary file, from which it is written to the session file
+    with tempfile.TemporaryFile() as tmpfile:
+        filtdata=np.memmap(tmpfile, dtype=dtype, mode="w+", shape=np.shape(data))
+        chain.apply(data, out=filtdata, workers=workers, blocksize=blocksize)
+        SaveSession(outfile, filtdata, clusters, markers, time, framerate, datatype, list(history)+chain.descriptions(), identifier, channels)
+        del filtdata
+    return outfile
+
+def FilterBlocks(blocks, filterfunc, *args):
+    """
+    Generator to apply one of the filter functions to blocks of data.
+    The overlap of the blocks is used as padding for the filter and removed afterwards, so it should be long enough for the filter transients to have decayed.
+    For the same result as filtering the data as a whole, use the blocksize of the filter functions or FilterRecording instead.
+
+    Parameters
+    ----------
+    blocks : iterable
+        Blocks as yielded by IterBlocks or ReadBlocks.
+    filterfunc : function
+        Filter function, e.g. bandpassfilter.
+    *args
+        Arguments of the filter function after the data, e.g. framerate, order and frequencies.
+
+    Yields
+    ------
+    start : int
+        Index of the first sample of the block.
+    stop : int
+        Index after the last sample of the block.
+    filtdata : Array
+        Array containing the filtered y-values per channel from start up to stop.
+
+    """
+    for start, stop, pre, block in blocks:
+        yield start, stop, filterfunc(block, *args)[:, pre:pre+stop-start]
+
+def BlockPeaks(blocks, threshold, subthresh=0.8):
+    """
+    Function to find peaks per channel in blocks of data.
+    Peaks are searched for in every block including its overlap, and kept when they are within the block itself.
+    The overlap should be longer than a spike, so that peaks on the border between two blocks are found.
+
+    Parameters
+    ----------
+    blocks : iterable
+        Blocks as yielded by IterBlocks or ReadBlocks.
+    threshold : int
+        Threshold for which peaks need to be found.
+    subthresh : float, optional
+        Proportion that determines how far the signal needs to go below the signal before the function searches for another peak. The default is 0.8.
+
+    Returns
+    -------
+    peakdata : list
+        List containing per channel a tuple with the peak locations and a dictionary containing the peak heights, see find_peaks.
+
+    """
+    locations=[]
+    heights=[]
+    for start, stop, pre, block in blocks:
+        if not locations:
+            locations=[[] for _ in block]
+            heights=[[] for _ in block]
+        for ii, chdata in enumerate(block):
+            (peaks, peakheights), _=find_peaks(chdata, threshold, subthresh=subthresh)
+            keep=(peaks>=pre)&(peaks<pre+stop-start)
+            locations[ii].append(peaks[keep]+start-pre)
+            heights[ii].append(peakheights["peak_heights"][keep])
+    return [(np.concatenate(locations[ii]), {"peak_heights": np.concatenate(heights[ii])}) for ii in range(len(locations))]
+
+def bandpassfilter(data, framerate, order, frequencies, dtype=np.float64, workers=None, blocksize=None):
     """
     Function to apply a bandpass filter to the given multichannel data.
 
@@ -150,6 +750,12 @@ def bandpassfilter(data, framerate, order, frequencies):
         Order of the filter.
     frequencies : list
         List containing first the lower, then the upper bound values of the frequencies to keep.
+    dtype : dtype, optional
+        Data type of the filtered data, see sosfilter. The default is np.float64.
+    workers : int, optional
+        Number of threads to filter channels in parallel, see sosfilter. The default is None.
+    blocksize : int, optional
+        Number of samples per block, to filter memory-mapped data in blocks with the same result, see sosfilter. The default is None.
 
     Returns
     -------
@@ -157,14 +763,12 @@ def bandpassfilter(data, framerate, order, frequencies):
         List containing the filtered data per channel.
 
     """
-    #Nyquist frequency
-    nyq = framerate/2
-    #Calculate bandpass filter coefficients for a matlabstyle iir filter
-    b, a = butter(order, [freq/nyq for freq in frequencies], btype='band')
+    #Get the second-order sections of the bandpass filter, designs are cached
+    sos=DesignFilter("band", order, frequencies, framerate)
     #Apply filter
-    return np.array([filtfilt(b,a, channel) for channel in data])
+    return sosfilter(data, sos, dtype, workers=workers, blocksize=blocksize)
 
-def notchfilter(data, framerate, quality, frequency):
+def notchfilter(data, framerate, quality, frequency, dtype=np.float64, workers=None, blocksize=None):
     """
     Function to apply a notch filter to the given multichannel data.
 
@@ -178,6 +782,12 @@ def notchfilter(data, framerate, quality, frequency):
         quality of the filter.
     frequency : int
         Frequency to be filtered out.
+    dtype : dtype, optional
+        Data type of the filtered data, see sosfilter. The default is np.float64.
+    workers : int, optional
+        Number of threads to filter channels in parallel, see sosfilter. The default is None.
+    blocksize : int, optional
+        Number of samples per block, to filter memory-mapped data in blocks with the same result, see sosfilter. The default is None.
 
     Returns
     -------
@@ -185,12 +795,12 @@ def notchfilter(data, framerate, quality, frequency):
         List containing the filtered data per channel.
 
     """
-    #Calculate notch filter coefficients for a 2nd order matlab style iir filter.
-    b, a=iirnotch(frequency, quality, framerate)
+    #Get the second-order sections of the 2nd order notch filter, designs are cached
+    sos=DesignFilter("notch", 2, frequency, framerate, quality)
     #Apply filter
-    return np.array([filtfilt(b,a, channel) for channel in data])
+    return sosfilter(data, sos, dtype, workers=workers, blocksize=blocksize)
 
-def passfilter(data, framerate, order, frequency, highlow):
+def passfilter(data, framerate, order, frequency, highlow, dtype=np.float64, workers=None, blocksize=None):
     """
     Function to apply a highpass or lowpass filter to the given multichannel data.
 
@@ -206,6 +816,12 @@ def passfilter(data, framerate, order, frequency, highlow):
         Frequency to be filtered out.
     highlow : str
         "high" for a highpass filter. "low" for a lowpass filter.
+    dtype : dtype, optional
+        Data type of the filtered data, see sosfilter. The default is np.float64.
+    workers : int, optional
+        Number of threads to filter channels in parallel, see sosfilter. The default is None.
+    blocksize : int, optional
+        Number of samples per block, to filter memory-mapped data in blocks with the same result, see sosfilter. The default is None.
 
     Returns
     -------
@@ -213,18 +829,123 @@ def passfilter(data, framerate, order, frequency, highlow):
         List containing the filtered data per channel.
 
     """
-    #Nyquist frequency
-    nyq = framerate/2
-    #Calculate highpass filter coefficients for a matlabstyle iir filter
-    b, a = butter(order, frequency/nyq, btype=highlow)
+    #Get the second-order sections of the highpass or lowpass filter, designs are cached
+    sos=DesignFilter(highlow, order, frequency, framerate)
     #Apply filter
-    return np.array([filtfilt(b,a, channel) for channel in data])
+    return sosfilter(data, sos, dtype, workers=workers, blocksize=blocksize)
+
+def _peakreleases(valid, starts, previous, ends):
+    """
+    Function to find which intervals between release crossings end with a released peak, see find_peaks.
+    Every interval either starts right after a release, at its first armed sample, or is already armed from the previous interval and starts at its first sample.
+    The interval before the first interval is taken to end with a release.
+
+    Parameters
+    ----------
+    valid : Array of int64
+        Cumulative count of the candidate peaks, with a leading 0.
+    starts : Array of int64
+        Per interval, the start if the previous interval ended with a release.
+    previous : Array of int64
+        Per interval, the start if the interval is already armed, the sample after the previous release crossing.
+    ends : Array of int64
+        Per interval, the release crossing that ends it.
+
+    Returns
+    -------
+    release : Array of bool
+        Per interval, if it ends with a release.
+    armed : Array of bool
+        Per interval, if it was already armed at its start.
+
+    """
+    #Candidates in the interval if it is armed from the start, and if it is armed at the first sample below the threshold
+    armedrelease=valid[ends]>valid[previous]
+    release=valid[ends]>valid[starts]
+    #Only intervals where the two differ depend on the previous interval, which is rare
+    for ii in np.flatnonzero(armedrelease&~release):
+        release[ii]=not (release[ii-1] if ii>0 else True)
+    armed=~np.concatenate(([True], release[:-1]))
+    return release, armed
 
 def find_peaks(data, threshold, offset=0, subthresh=0.8):
     """
     Function to find peaks.
     Search method uses thresholds and a subthreshold proportion.
     Signal needs to go below the threshold before it searches for the first peak, and below the subthresh proportion of the threshold for subsequent peaks.
+    The samples below the threshold, the local maxima above it and the crossings below the subthreshold are found with boolean masks, after which the highest local maximum per peak is found with reduceat.
+    The result is the same as searching one sample at a time, for a subthresh above 1 the peaks are searched one sample at a time.
+
+    Parameters
+    ----------
+    data : list
+        List containing the signal data.
+    threshold : int
+        Threshold for which peaks need to be found.
+    offset : int, optional
+        Signal off-set. The default is 0.
+    subthresh : float, optional
+        Proportion that determines how far the signal needs to go below the signal before the function searches for another peak. The default is 0.8.
+
+    Returns
+    -------
+    peakdata : tuple
+        Tuple containing a list of the peak times and a dictionary containing the peak heights.
+    peakcount : int
+        The amount of peaks found.
+
+    """
+    if subthresh>1:
+        #Crossings below the subthreshold are not always below the threshold, which the masks rely on
+        return _find_peaks_reference(data, threshold, offset, subthresh)
+    data=np.asarray(data)
+    values=-data if threshold<0 else data
+    threshold=abs(threshold)
+    last=len(values)
+    empty=(np.empty(0), {"peak_heights": np.empty(0)})
+    if last<3:
+        return empty, 0
+    #Samples that arm the search, local maxima above the threshold, and crossings below the subthreshold
+    armed=np.flatnonzero(values<threshold+offset)
+    inner=values[1:-1]
+    local=np.zeros(last, dtype=bool)
+    local[1:-1]=(inner>=threshold+offset)&(inner>=values[:-2])&(inner>=values[2:])
+    ends=np.flatnonzero((values[:-1]>=subthresh*threshold+offset)&(values[1:]<subthresh*threshold+offset))+1
+    if not len(ends) or not len(armed):
+        return empty, 0
+    #Start of every interval between crossings if it is already armed, and if the previous interval ended with a release, at its first armed sample
+    previous=np.concatenate(([0], ends[:-1]+1))
+    starts=armed[np.searchsorted(armed, previous)]
+    #Local maxima must be higher than the threshold before the first peak, and higher than 0 after
+    first=np.concatenate(([0], np.cumsum(local&(values>threshold))))
+    later=np.concatenate(([0], np.cumsum(local&(values>0))))
+    release, armedstart=_peakreleases(first, starts, previous, ends)
+    if release.any():
+        jj=np.argmax(release)+1
+        release[jj:], armedstart[jj:]=_peakreleases(later, starts[jj:], previous[jj:], ends[jj:])
+    #Search range of every peak, from its start up to its release
+    lower=np.where(armedstart, previous, starts)[release]
+    upper=ends[release]
+    candidates=np.flatnonzero(local)
+    lo, hi=np.searchsorted(candidates, lower), np.searchsorted(candidates, upper)
+    #Highest local maximum per peak, the first one if several are equally high
+    heights=np.append(values[candidates], values.dtype.type(0))
+    bounds=np.ravel(np.column_stack((lo, hi)))
+    peakmax=np.maximum.reduceat(heights, bounds)[::2]
+    counts=hi-lo
+    segment=np.repeat(np.arange(len(lo)), counts)
+    inside=np.arange(counts.sum())+np.repeat(lo-np.cumsum(counts)+counts, counts)
+    top=heights[inside]==peakmax[segment]
+    locations=candidates[inside[top][np.unique(segment[top], return_index=True)[1]]]
+    peaks=np.array([locations, data[locations]], dtype=np.float64)
+    peakdata=(peaks[0], {"peak_heights": peaks[1]})
+    return peakdata, len(locations)
+
+def _find_peaks_reference(data, threshold, offset=0, subthresh=0.8):
+    """
+    Function to find peaks, one sample at a time. Reference for find_peaks, which gives the same result.
+    Search method uses thresholds and a subthreshold proportion.
+    Signal needs to go below the threshold before it searches for the first peak, and below the subthresh proportion of the threshold for subsequent peaks.
 
     Parameters
     ----------
@@ -280,7 +1001,145 @@ def find_peaks(data, threshold, offset=0, subthresh=0.8):
     peakdata=(peaks[0], {"peak_heights": peaks[1]})
     return peakdata, peakcount
 
-def SpikeSorting(DataSelection,thresholds,subthresh,framerate,time,cutoff_thresh=False):
+def _peakkernel(values, armlevel, releaselevel, firstmax):
+    """
+    Function to find peak locations one sample at a time, with the same steps as _find_peaks_reference.
+    Compiled with numba when it is installed, see find_peaks_compiled.
+    """
+    last=len(values)
+    locations=np.empty(last, dtype=np.int64)
+    count=0
+    peakstart=False
+    peaklocation=0
+    peakmax=firstmax
+    for ii in range(last):
+        peak=values[ii]
+        #only look for a peak if the data has gone below the threshold
+        if peak<armlevel:
+            peakstart=True
+        #Check if the peak is a local maximum, and exclude first and last values
+        if ii>0 and ii<last-1 and peak>=armlevel:
+            if peak>=values[ii-1] and peak>=values[ii+1] and peakstart and peak>peakmax:
+                peaklocation=ii
+                peakmax=peak
+        #If the start of a peak has been found, check if the peak drops below the subthreshold
+        if peaklocation:
+            if values[ii-1]>=releaselevel and peak<releaselevel and peakstart:
+                locations[count]=peaklocation
+                count+=1
+                #Reset peak finding variables
+                peakmax=0.0
+                peaklocation=0
+                peakstart=False
+    return locations[:count]
+
+if numba is not None:
+    _peakkernel=numba.njit(cache=True, nogil=True)(_peakkernel)
+
+def _level(values, level):
+    """Function to round a threshold level to the type in which numpy compares it with values, so the compiled kernel compares in float64 with the same result."""
+    if values.dtype.kind=="f":
+        return float(np.asarray(level, dtype=np.result_type(values.dtype, level)))
+    return float(level)
+
+def find_peaks_compiled(data, threshold, offset=0, subthresh=0.8):
+    """
+    Function to find peaks with a compiled loop over the samples, requires numba for the speed of compiled code.
+    The result is the same as find_peaks, see find_peaks for the parameters and returns.
+    """
+    data=np.asarray(data)
+    values=-data if threshold<0 else data
+    threshold=abs(threshold)
+    locations=_peakkernel(values.astype(np.float64, copy=False), _level(values, threshold+offset), _level(values, subthresh*threshold+offset), _level(values, threshold))
+    peaks=np.array([locations, data[locations]], dtype=np.float64)
+    peakdata=(peaks[0], {"peak_heights": peaks[1]})
+    return peakdata, len(locations)
+
+#Peak detection backends, from fastest to slowest, the first available backend is used by default
+PEAKBACKENDS={"numba": find_peaks_compiled, "numpy": find_peaks, "python": _find_peaks_reference}
+
+def PeakBackend(backend=None):
+    """
+    Function to get a peak detection backend from PEAKBACKENDS.
+    The numba backend is only available when numba is installed, otherwise the next backend is used.
+
+    Parameters
+    ----------
+    backend : str, optional
+        Name of the backend, "numba", "numpy" or "python". The default is None, for the fastest available backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown.
+
+    Returns
+    -------
+    name : str
+        Name of the used backend.
+    function : function
+        Peak detection function with the arguments and returns of find_peaks.
+
+    """
+    names=list(PEAKBACKENDS)
+    if backend is None:
+        backend=names[0]
+    if backend not in PEAKBACKENDS:
+        raise ValueError(f"Unknown peak detection backend {backend}, use {', '.join(names)}.")
+    if backend=="numba" and numba is None:
+        backend="numpy"
+    return backend, PEAKBACKENDS[backend]
+
+def ThresholdBands(data, thresholds, subthresh=0.8, cutoff_thresh=False, find_peaks=find_peaks):
+    """
+    Function to find the spikes of all thresholds in one pass per sign, instead of one pass per threshold.
+    Peaks are found once at the threshold with the smallest absolute value of every sign, and every peak is assigned to the threshold band it belongs to: the highest threshold its height reaches.
+    Peaks that reach the cut-off threshold, of the same sign, are not assigned to any threshold.
+
+    Parameters
+    ----------
+    data : list
+        List containing the signal data.
+    thresholds : list
+        List containing the thresholds.
+    subthresh : float, optional
+        Proportion that determines how far the signal needs to go below the threshold before searching for a new spike. The default is 0.8.
+    cutoff_thresh : int or bool, optional
+        Integer if the cut-off threshold is being used, otherwise the bool False. The default is False.
+    find_peaks : function, optional
+        Peak detection function, see PeakBackend. The default is find_peaks.
+
+    Returns
+    -------
+    bands : list
+        List containing per threshold, in the order of thresholds, a tuple with the peak locations and the peak heights.
+
+    """
+    thresholds=np.asarray(thresholds)
+    bands=[(np.empty(0, dtype=np.int64), np.empty(0)) for _ in thresholds]
+    for negative in (False, True):
+        indices=np.flatnonzero((thresholds<0)==negative)
+        if not len(indices):
+            continue
+        levels=np.abs(thresholds[indices])
+        (locations, peakheights), _=find_peaks(data, -levels.min() if negative else levels.min(), subthresh=subthresh)
+        locations=locations.astype(np.int64)
+        heights=peakheights["peak_heights"]
+        magnitude=-heights if negative else heights
+        keep=np.ones(len(locations), dtype=bool)
+        if type(cutoff_thresh)==int and (cutoff_thresh<0)==negative:
+            keep=magnitude<abs(cutoff_thresh)
+        #Index of the highest threshold reached by every peak
+        order=np.argsort(levels, kind="stable")
+        band=np.searchsorted(levels[order], magnitude, side="right")-1
+        for position, index in enumerate(indices[order]):
+            selection=keep&(band==position)
+            bands[index]=(locations[selection], heights[selection])
+    return bands
+
+SORTINGMETHODS=("single", "legacy")
+
+def SpikeSorting(DataSelection,thresholds,subthresh,framerate,time,cutoff_thresh=False,backend=None,method="legacy"):
     """
     Function to sort spikes based on thresholds
 
@@ -294,49 +1153,96 @@ def SpikeSorting(DataSelection,thresholds,subthresh,framerate,time,cutoff_thresh
         Float determining how far the signal needs to go below the threshold before searching for a new spike.
     framerate : int
         Sampling rate of the data.
-    time : Array of float64
-        Array containing x-values per channel. First index is channel, second contains x-values.
+    time : TimeAxis
+        Time axis of the data, gives the x-values in seconds.
     cutoff_thresh : int or bool
         Integer if the cut-off threshold is being used, otherwise the bool False. The default is False.
+    backend : str, optional
+        Peak detection backend, see PeakBackend. The default is None, for the fastest available backend.
+    method : str, optional
+        "single" to find the spikes of all thresholds in one pass per sign, see ThresholdBands, or "legacy" to find the spikes once per threshold and once for the cut-off.
+        With "legacy", a spike belongs to the first threshold that finds it at the same location, with "single" to the highest threshold its height reaches, so a few spikes can be in a different cluster or not found. The default is "legacy".
+
+    Returns
+    -------
+    clusters : SpikeTable
+        Table containing the sample index, channel, cluster and height of every spike, and the threshold and marker height per channel and cluster.
+
+    """
+    if method not in SORTINGMETHODS:
+        raise ValueError(f"Unknown spike sorting method {method}, use {', '.join(SORTINGMETHODS)}.")
+    _, find_peaks=PeakBackend(backend)
+    if method=="legacy":
+        return _spikesortinglegacy(DataSelection, thresholds, subthresh, framerate, cutoff_thresh, find_peaks)
+    columns={"sample": [], "channel": [], "cluster": [], "amplitude": []}
+    markerheights=np.zeros((len(DataSelection), len(thresholds)))
+    for ii in range(len(DataSelection)):
+        #Get largest peak of selected data
+        maxval=np.nanmax(DataSelection[ii])
+        bands=ThresholdBands(DataSelection[ii], thresholds, subthresh, cutoff_thresh, find_peaks)
+        for clusterN, (locations, heights) in enumerate(bands):
+            columns["sample"].append(locations)
+            columns["channel"].append(np.full(len(locations), ii))
+            columns["cluster"].append(np.full(len(locations), clusterN))
+            columns["amplitude"].append(heights)
+            #y value for points denothing peaks above largest peak
+            markerheights[ii][clusterN]=maxval+(maxval/10*(clusterN+1))
+    columns={key: np.concatenate([np.empty(0)]+values) for key, values in columns.items()}
+    thresholds=np.tile(np.asarray(thresholds, dtype=np.float64), (len(DataSelection), 1))
+    return SpikeTable(columns["sample"], columns["channel"], columns["cluster"], columns["amplitude"], thresholds, markerheights, framerate)
+
+def _insorted(values, sortedvalues):
+    """Function to test for every value if it is in a sorted array, with a binary search instead of comparing with every element."""
+    index=np.searchsorted(sortedvalues, values).clip(0, max(len(sortedvalues)-1, 0))
+    return sortedvalues[index]==values if len(sortedvalues) else np.zeros(len(values), dtype=bool)
+
+def _spikesortinglegacy(DataSelection,thresholds,subthresh,framerate,cutoff_thresh,find_peaks):
+    """
+    Function to sort spikes based on thresholds, with one pass per threshold and one for the cut-off, see SpikeSorting.
+
+    Parameters
+    ----------
+    DataSelection : list
+        A list containing the signal data in the selected time frames per channel.
+    thresholds : list
+        List containing the thresholds, ordered from the absolute value of the largest to the absolute value of the smallest.
+    subthresh : float
+        Float determining how far the signal needs to go below the threshold before searching for a new spike.
+    framerate : int
+        Sampling rate of the data.
+    cutoff_thresh : int or bool
+        Integer if the cut-off threshold is being used, otherwise the bool False.
+    find_peaks : function
+        Peak detection function, see PeakBackend.
 
     Returns
     -------
-    clusters : list
-        A list containing all peaks above threshold height, timestamps of peaks, heights of peaks, height of spike marker per peak, and the threshold height per threshold per channel.
-
-    """
-    # First, get everything above cutoff if cutoff is given
-    cutoff1=[[[]] for _ in range(len(DataSelection))]
-    if type(cutoff_thresh)==int:
-        for ii in range(len(DataSelection)):
-            th = cutoff_thresh
-            cutoff1[ii], _ = find_peaks(DataSelection[ii], threshold=th, subthresh=subthresh)
-        
-    cl2=[[] for _ in range(len(DataSelection))]
-    maxval=[[] for _ in range(len(DataSelection))]
-    #clusters: [[peak data], [time], [plot height of points], ["Cluster threshold {threshold}"]
-    clusters=[[[[],[],[],[],np.array([th], dtype=np.float64)] for ii,th in enumerate(thresholds)] for _ in range(len(DataSelection))]
-    maxsize=1
+    clusters : SpikeTable
+        Table containing the sample index, channel, cluster and height of every spike, and the threshold and marker height per channel and cluster.
+
+    """
+    columns={"sample": [], "channel": [], "cluster": [], "amplitude": []}
+    markerheights=np.zeros((len(DataSelection), len(thresholds)))
     for ii in range(len(DataSelection)):
         #Get largest peak of selected data
-        cl2[ii]=np.nanmax(DataSelection[ii])
-        maxval[ii]=cl2[ii]
+        maxval=np.nanmax(DataSelection[ii])
+        #Sorted peak locations of the cut-off and of the previous clusters, a peak is only added to the first cluster that finds it
+        found=np.empty(0, dtype=np.int64)
+        if type(cutoff_thresh)==int:
+            (locations, _), _=find_peaks(DataSelection[ii], threshold=cutoff_thresh, subthresh=subthresh)
+            found=np.sort(np.asarray(locations, dtype=np.int64))
         #Detect the other spikes per cluster
         for clusterN,th in enumerate(thresholds):
-            clusters[ii][clusterN][0],_ = find_peaks(DataSelection[ii], threshold=th, subthresh=subthresh)
-            for peakN,x in enumerate(clusters[ii][clusterN][0][0]):
-                if x not in cutoff1[ii][0] and not any(x in clusters[ii][jj][0][0] for jj in range(clusterN)):
-                    clusters[ii][clusterN][1].append(x/framerate)
-                    clusters[ii][clusterN][2].append(clusters[ii][clusterN][0][1]["peak_heights"][peakN])
-            clusters[ii][clusterN][1]=np.array(clusters[ii][clusterN][1])
-            clusters[ii][clusterN][2]=np.array(clusters[ii][clusterN][2])
+            (locations, properties), _=find_peaks(DataSelection[ii], threshold=th, subthresh=subthresh)
+            peaks=np.asarray(locations, dtype=np.int64)
+            new=~_insorted(peaks, found)
+            columns["sample"].append(peaks[new])
+            columns["channel"].append(np.full(np.sum(new), ii))
+            columns["cluster"].append(np.full(np.sum(new), clusterN))
+            columns["amplitude"].append(np.asarray(properties["peak_heights"], dtype=np.float64)[new])
+            found=np.union1d(found, peaks)
             #y value for points denothing peaks above largest peak
-            clusters[ii][clusterN][3] = np.ones(len(clusters[ii][clusterN][1] ))*maxval[ii]+(maxval[ii]/10*(clusterN+1))
-            if len(clusters[ii][clusterN][0][0])>maxsize:
-                maxsize=len(clusters[ii][clusterN][0][0])
-    for ii in range(len(clusters)):
-        for jj in range(len(clusters[ii])):
-            clusters[ii][jj][0]=clusters[ii][jj][0][0]
-            for kk in range(len(clusters[ii][jj])):
-                clusters[ii][jj][kk]=np.append(clusters[ii][jj][kk], np.zeros(maxsize-len(clusters[ii][jj][kk]))+np.nan)
-    return clusters
+            markerheights[ii][clusterN]=maxval+(maxval/10*(clusterN+1))
+    columns={key: np.concatenate([np.empty(0)]+values) for key, values in columns.items()}
+    thresholds=np.tile(np.asarray(thresholds, dtype=np.float64), (len(DataSelection), 1))
+    return SpikeTable(columns["sample"], columns["channel"], columns["cluster"], columns["amplitude"], thresholds, markerheights, framerate)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+
+class SpikeTable:
+    """
+    Table of sorted spikes, with one row per spike and one array per column: sample index, channel, cluster and amplitude.
+    Rows are sorted by channel, cluster and sample, and the rows of every channel and cluster are found with CSR-style offsets.
+    Memory grows with the number of spikes, instead of with the number of channels times clusters times the largest cluster.
+    """
+    def __init__(self, sample, channel, cluster, amplitude, thresholds, markerheights, framerate):
+        """
+        Parameters
+        ----------
+        sample : Array of int
+            Sample index of every spike.
+        channel : Array of int
+            Channel index of every spike.
+        cluster : Array of int
+            Cluster index of every spike.
+        amplitude : Array of float
+            Height of every spike.
+        thresholds : Array of float
+            Threshold per channel and cluster, with shape (channels, clusters).
+        markerheights : Array of float
+            Height at which the spikes are marked in plots, per channel and cluster, with shape (channels, clusters).
+        framerate : int
+            Sampling rate of the data.
+
+        """
+        self.thresholds=np.asarray(thresholds, dtype=np.float64)
+        self.markerheights=np.asarray(markerheights, dtype=np.float64).reshape(self.thresholds.shape)
+        self.framerate=framerate
+        sample=np.asarray(sample, dtype=np.int64)
+        channel=np.asarray(channel, dtype=np.int64)
+        cluster=np.asarray(cluster, dtype=np.int64)
+        order=np.lexsort((sample, cluster, channel))
+        self.sample=sample[order]
+        self.channel=channel[order]
+        self.cluster=cluster[order]
+        self.amplitude=np.asarray(amplitude, dtype=np.float64)[order]
+        #Row of the first spike per channel and cluster, and the number of rows at the end
+        keys=self.channel*self.nclusters+self.cluster
+        self.offsets=np.searchsorted(keys, np.arange(self.nchannels*self.nclusters+1)).astype(np.int64)
+
+    @classmethod
+    def empty(cls, framerate=1):
+        """Method to create a table without channels and clusters, for data that is not spike sorted."""
+        return cls([], [], [], [], np.empty((0, 0)), np.empty((0, 0)), framerate)
+
+    @classmethod
+    def fromclusters(cls, clusters, framerate):
+        """
+        Method to create a table from NaN padded clusters, as made by SpikeSorting before the table was added.
+
+        Parameters
+        ----------
+        clusters : list
+            A list containing all peaks above threshold height, timestamps of peaks, heights of peaks, height of spike marker per peak, and the threshold height per threshold per channel.
+        framerate : int
+            Sampling rate of the data.
+
+        Returns
+        -------
+        table : SpikeTable
+            Table containing the spikes of the clusters, the sample index is calculated from the timestamp.
+
+        """
+        if isinstance(clusters, cls):
+            return clusters
+        columns={"sample": [], "channel": [], "cluster": [], "amplitude": []}
+        thresholds=np.array([[np.asarray(clus[4], dtype=np.float64)[0] for clus in chan] for chan in clusters], dtype=np.float64)
+        if thresholds.ndim!=2:
+            thresholds=thresholds.reshape(len(clusters), 0)
+        markerheights=np.full(thresholds.shape, np.nan)
+        for ii, chan in enumerate(clusters):
+            for jj, clus in enumerate(chan):
+                times=np.asarray(clus[1], dtype=np.float64)
+                valid=~np.isnan(times)
+                columns["sample"].append(np.rint(times[valid]*framerate).astype(np.int64))
+                columns["channel"].append(np.full(np.sum(valid), ii, dtype=np.int64))
+                columns["cluster"].append(np.full(np.sum(valid), jj, dtype=np.int64))
+                columns["amplitude"].append(np.asarray(clus[2], dtype=np.float64)[valid])
+                if np.any(valid):
+                    markerheights[ii, jj]=np.asarray(clus[3], dtype=np.float64)[valid][0]
+        columns={key: np.concatenate([np.empty(0)]+values) for key, values in columns.items()}
+        return cls(columns["sample"], columns["channel"], columns["cluster"], columns["amplitude"], thresholds, markerheights, framerate)
+
+    @property
+    def nchannels(self):
+        return self.thresholds.shape[0]
+
+    @property
+    def nclusters(self):
+        return self.thresholds.shape[1]
+
+    @property
+    def time(self):
+        """Time in seconds of every spike."""
+        return self.sample/self.framerate
+
+    def counts(self):
+        """Method to get the number of spikes per channel and cluster, with shape (channels, clusters)."""
+        return np.diff(self.offsets).reshape(self.thresholds.shape)
+
+    def rows(self, channel, cluster):
+        """Method to get the slice of the rows of a channel and cluster."""
+        key=channel*self.nclusters+cluster
+        return slice(self.offsets[key], self.offsets[key+1])
+
+    def samples(self, channel, cluster):
+        """Method to get the sample indices of the spikes of a channel and cluster."""
+        return self.sample[self.rows(channel, cluster)]
+
+    def times(self, channel, cluster):
+        """Method to get the time in seconds of the spikes of a channel and cluster."""
+        return self.sample[self.rows(channel, cluster)]/self.framerate
+
+    def amplitudes(self, channel, cluster):
+        """Method to get the heights of the spikes of a channel and cluster."""
+        return self.amplitude[self.rows(channel, cluster)]
+
+    def markers(self, channel, cluster):
+        """Method to get the height at which the spikes of a channel and cluster are marked in plots."""
+        key=self.rows(channel, cluster)
+        return np.full(key.stop-key.start, self.markerheights[channel, cluster])
+
+    def threshold(self, channel, cluster):
+        """Method to get the threshold of a channel and cluster."""
+        return self.thresholds[channel, cluster]
+
+    def labels(self, channel=0):
+        """Method to get the label of every cluster of a channel, as shown in the GUI."""
+        return [f'Cluster {th}' for th in self.thresholds[channel]] if self.nchannels else []
+
+    def resample(self, framerate, nframes=None):
+        """
+        Method to get the table at another framerate, for data that is resampled after sorting.
+
+        Parameters
+        ----------
+        framerate : int or float
+            New sampling rate of the data.
+        nframes : int, optional
+            Number of samples of the resampled data, sample indices are limited to the last sample. The default is None, to not limit them.
+
+        Returns
+        -------
+        table : SpikeTable
+            Table with the sample index of every spike rounded to the nearest sample at the new framerate.
+
+        """
+        sample=np.rint(self.sample*(framerate/self.framerate)).astype(np.int64)
+        if nframes is not None:
+            sample=np.minimum(sample, nframes-1)
+        return SpikeTable(sample, self.channel, self.cluster, self.amplitude, self.thresholds, self.markerheights, framerate)
+
+    def __len__(self):
+        return len(self.sample)
+
+    def __repr__(self):
+        return f"SpikeTable({len(self)} spikes, channels={self.nchannels}, clusters={self.nclusters}, framerate={self.framerate})"
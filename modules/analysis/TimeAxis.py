@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+
+class TimeAxis:
+    """
+    Time axis of a recording, defined by the framerate, the time of the first sample and the number of samples.
+    Time values are calculated when they are requested, instead of being stored per sample.
+    Indexing and slicing return the time in seconds, and the axis can be passed to numpy and matplotlib as an array.
+    """
+    def __init__(self, framerate, length, offset=0.0):
+        """
+        Parameters
+        ----------
+        framerate : int
+            Sampling rate of the data.
+        length : int
+            Number of samples.
+        offset : float, optional
+            Time in seconds of the first sample. The default is 0.0.
+
+        """
+        self.framerate=framerate
+        self.length=int(length)
+        self.offset=float(offset)
+
+    @classmethod
+    def fromrecord(cls, record):
+        """
+        Method to create a time axis from the array made by torecord.
+
+        Parameters
+        ----------
+        record : Array of float64
+            Array containing the framerate, offset and length.
+
+        Returns
+        -------
+        timeaxis : TimeAxis
+            The time axis described by the record.
+
+        """
+        framerate, offset, length=np.asarray(record, dtype=np.float64)
+        if framerate==int(framerate):
+            framerate=int(framerate)
+        return cls(framerate, int(length), offset)
+
+    def torecord(self):
+        """Method to get an array containing the framerate, offset and length, to store the time axis in a .npz file."""
+        return np.array([self.framerate, self.offset, self.length], dtype=np.float64)
+
+    def seconds(self, index):
+        """
+        Method to convert sample indices to time.
+
+        Parameters
+        ----------
+        index : int or array of int
+            Sample indices.
+
+        Returns
+        -------
+        seconds : float or array of float64
+            Time in seconds of the samples.
+
+        """
+        return self.offset+np.asarray(index)/self.framerate
+
+    def index(self, seconds):
+        """
+        Method to convert time to the index of the nearest sample.
+
+        Parameters
+        ----------
+        seconds : float or array of float
+            Time in seconds.
+
+        Returns
+        -------
+        index : int or array of int64
+            Index of the nearest sample.
+
+        """
+        index=np.rint((np.asarray(seconds)-self.offset)*self.framerate).astype(np.int64)
+        if index.ndim==0:
+            return int(index)
+        return index
+
+    def slice(self, start, stop):
+        """
+        Method to get the slice of samples between two time points.
+
+        Parameters
+        ----------
+        start : float
+            Start time in seconds.
+        stop : float
+            Stop time in seconds.
+
+        Returns
+        -------
+        indices : slice
+            Slice of the samples from start up to stop, clipped to the length of the axis.
+
+        """
+        return slice(min(max(self.index(start), 0), self.length), min(max(self.index(stop), 0), self.length))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.offset+np.arange(*key.indices(self.length))/self.framerate
+        index=np.asarray(key)
+        if index.dtype==bool:
+            index=np.flatnonzero(index)
+        elif np.any((index>=self.length)|(index<-self.length)):
+            raise IndexError(f"index out of range for time axis with length {self.length}")
+        index=np.where(index<0, index+self.length, index)
+        return self.seconds(index)
+
+    def __array__(self, dtype=None, copy=None):
+        time=self[:]
+        if dtype is not None:
+            time=time.astype(dtype)
+        return time
+
+    def __repr__(self):
+        return f"TimeAxis(framerate={self.framerate}, length={self.length}, offset={self.offset})"
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+SpikeAnalysis tool. A tool to analyse neuronal spike activity.
+
+Copyright (C) 2024 Luk Sullock Enzlin
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import struct
+import numpy as np
+
+#Format tags of the fmt chunk
+WAVE_FORMAT_PCM=0x0001
+WAVE_FORMAT_IEEE_FLOAT=0x0003
+WAVE_FORMAT_EXTENSIBLE=0xFFFE
+
+
+class WavReader:
+    """
+    Reader for .wav files, including RF64 and BW64 files larger than 4 GB.
+    The header is parsed once when the reader is made, after which any range of samples can be read without reading the rest of the file.
+    Samples are returned as by scipy.io.wavfile.read: one column per channel, 8-bit as uint8, and 24-bit as int32 with the samples in the upper 24 bits.
+    """
+    def __init__(self, file):
+        """
+        Parameters
+        ----------
+        file : String
+            Path of the .wav file.
+
+        """
+        self.file=file
+        filesize=os.path.getsize(file)
+        with open(file, "rb") as wavfile:
+            riff, _, wave=struct.unpack("<4sI4s", wavfile.read(12))
+            if riff not in (b"RIFF", b"RIFX", b"RF64", b"BW64") or wave!=b"WAVE":
+                raise ValueError(f"{file} is not a .wav file, only RIFF, RIFX, RF64 and BW64 .wav files are supported.")
+            self.endian=">" if riff==b"RIFX" else "<"
+            datasize64=None
+            fmt=None
+            self.offset=None
+            #Go over the chunks until both the format and the start of the samples are known
+            while fmt is None or self.offset is None:
+                header=wavfile.read(8)
+                if len(header)<8:
+                    raise ValueError(f"{file} has no {'fmt' if fmt is None else 'data'} chunk.")
+                chunkid, size=struct.unpack(f"{self.endian}4sI", header)
+                start=wavfile.tell()
+                if chunkid==b"ds64":
+                    #64-bit sizes of RF64 and BW64 files
+                    _, datasize64, _=struct.unpack("<QQQ", wavfile.read(24))
+                elif chunkid==b"fmt ":
+                    fmt=wavfile.read(size)
+                elif chunkid==b"data":
+                    self.offset=start
+                    if size==0xFFFFFFFF and datasize64 is not None:
+                        size=datasize64
+                    #Recordings that were not closed properly can have a wrong size, the size is limited to the file
+                    self.datasize=min(size, filesize-start)
+                    if fmt is None:
+                        size=self.datasize
+                    else:
+                        break
+                #Chunks are padded to an even size
+                wavfile.seek(start+size+size%2)
+        self._parseformat(fmt)
+        self.nframes=self.datasize//self.blockalign
+        self.shape=(self.nframes, self.nchannels) if self.nchannels>1 else (self.nframes,)
+
+    def _parseformat(self, fmt):
+        """Method to get the sample format from the content of the fmt chunk."""
+        formattag, self.nchannels, self.framerate, _, self.blockalign, self.bits=struct.unpack(f"{self.endian}HHIIHH", fmt[:16])
+        if formattag==WAVE_FORMAT_EXTENSIBLE and len(fmt)>=26:
+            #The format tag is the first two bytes of the sub format GUID
+            formattag=struct.unpack(f"{self.endian}H", fmt[24:26])[0]
+        if self.bits%8 or self.blockalign!=self.nchannels*self.bits//8:
+            raise ValueError(f"{self.file} has an unsupported sample layout of {self.bits} bits in blocks of {self.blockalign} bytes.")
+        if formattag==WAVE_FORMAT_PCM and self.bits in (8, 16, 24, 32, 64):
+            self.dtype=np.dtype("u1" if self.bits==8 else f"{self.endian}i{self.bits//8 if self.bits!=24 else 4}")
+        elif formattag==WAVE_FORMAT_IEEE_FLOAT and self.bits in (32, 64):
+            self.dtype=np.dtype(f"{self.endian}f{self.bits//8}")
+        else:
+            raise ValueError(f"{self.file} has an unsupported format {formattag:#06x} with {self.bits} bits per sample.")
+
+    def memmap(self):
+        """
+        Method to memory-map the samples, so they are only read from disk when they are used.
+        24-bit samples can not be memory-mapped, a ValueError is raised for them.
+
+        Returns
+        -------
+        samples : memmap
+            Read-only memory-map with one column per channel, or one dimensional for a single channel.
+
+        """
+        if self.bits==24:
+            raise ValueError("24-bit .wav files can not be memory-mapped.")
+        return np.memmap(self.file, dtype=self.dtype, mode="r", offset=self.offset, shape=self.shape)
+
+    def read(self, start=0, stop=None, channels=None):
+        """
+        Method to read a range of samples.
+
+        Parameters
+        ----------
+        start : int, optional
+            Index of the first sample. The default is 0.
+        stop : int, optional
+            Index after the last sample. The default is None, for the end of the recording.
+        channels : int, list or slice, optional
+            Channels to return. The default is None, for all channels.
+
+        Returns
+        -------
+        samples : Array
+            Array with one column per channel, or one dimensional for a single channel or when channels is an int.
+
+        """
+        start, stop, _=slice(start, stop).indices(self.nframes)
+        count=max(stop-start, 0)
+        with open(self.file, "rb") as wavfile:
+            wavfile.seek(self.offset+start*self.blockalign)
+            if self.bits==24:
+                raw=np.fromfile(wavfile, dtype=np.uint8, count=count*self.blockalign).reshape(count, self.nchannels, 3)
+                #Place the 3 bytes in the upper bytes of an int32
+                samples=np.zeros((count, self.nchannels, 4), dtype=np.uint8)
+                samples[:, :, 1:]=raw if self.endian=="<" else raw[:, :, ::-1]
+                samples=samples.view("<i4")[:, :, 0]
+            else:
+                samples=np.fromfile(wavfile, dtype=self.dtype, count=count*self.nchannels).reshape(count, self.nchannels)
+        if channels is not None:
+            samples=samples[:, channels]
+        elif self.nchannels==1:
+            samples=samples[:, 0]
+        return samples
+
+    def __repr__(self):
+        return f"WavReader({self.file!r}, framerate={self.framerate}, channels={self.nchannels}, frames={self.nframes}, dtype={self.dtype})"